@@ -6,6 +6,7 @@ from OpenGL import GL, GLU
 import pyglet
 # cocos2d
 import cocos
+from cocos import euclid
 from cocos.director import director
 from .utility import reverse
 
@@ -20,6 +21,47 @@ class SmartNode(cocos.cocosnode.CocosNode, pyglet.event.EventDispatcher):
   def transform(self):
     super(SmartNode, self).transform()
   
+  @property
+  def visible(self):
+    return self.__visible
+  
+  @visible.setter
+  def visible(self, value):
+    if getattr(self, '_SmartNode__visible', None) != value:
+      self.__visible = value
+      self.invalidate_hit_test()
+  
+  @property
+  def layer(self):
+    """The nearest `SmartLayer` containing this node, if any."""
+    parent = self.parent
+    while parent is not None and not isinstance(parent, SmartLayer):
+      parent = parent.parent
+    return parent
+  
+  def add(self, child, *args, **kwargs):
+    super(SmartNode, self).add(child, *args, **kwargs)
+    self.invalidate_hit_test()
+  
+  def remove(self, obj):
+    super(SmartNode, self).remove(obj)
+    self.invalidate_hit_test()
+  
+  def invalidate_hit_test(self):
+    """Notifies the layer that objects under cursor
+    may have changed (e. g. the node was moved).
+    """
+    layer = self.layer
+    if layer is not None:
+      layer.invalidate_hit_test()
+  
+  def hit_test(self, x, y):
+    """Returns True if point (`x`, `y`), given in
+    node's local coordinates, lies on the node itself
+    (children are tested separately).
+    """
+    return False
+  
   def before_visit(self):
     GL.glPushName(id(self))
   
@@ -83,16 +125,67 @@ class SmartLayer(cocos.layer.base_layers.Layer):
     self.focused = None
     self.highlighted = []
     self.__mouse_position = (-1, -1)
+    self.__hit_test_dirty = True
+  
+  # either 'cpu' (rectangular checks against nodes' boxes)
+  # or 'gl' (re-rendering the layer in GL_SELECT mode)
+  picking = 'cpu'
   
   def objects_under_cursor(self, x, y):
     """Writes to `self.highlighted` list of
     objects under cursor, in descending order
     (the first is the top element).
     """
+    if self.picking == 'cpu':
+      result = self.__pick_cpu(x, y)
+    elif self.picking == 'gl':
+      result = self.__pick_gl(x, y)
+    else:
+      raise ValueError('Invalid picking mode: %r' % self.picking)
+    
+    old_result = self.highlighted
+    new_result = list(result)
+    self.highlighted = new_result
+    for obj in set(old_result) - set(new_result):
+      obj.mouse_out()
+    for obj in set(new_result) - set(old_result):
+      obj.mouse_enter()
+    return new_result
+  
+  def invalidate_hit_test(self):
+    """Makes the layer recompute objects under
+    cursor before the next frame is drawn.
+    """
+    self.__hit_test_dirty = True
+  
+  def add(self, child, *args, **kwargs):
+    super(SmartLayer, self).add(child, *args, **kwargs)
+    self.invalidate_hit_test()
+  
+  def remove(self, obj):
+    super(SmartLayer, self).remove(obj)
+    self.invalidate_hit_test()
+  
+  def __move_mouse(self, x, y):
+    if self.__mouse_position != (x, y):
+      self.__mouse_position = (x, y)
+      self.invalidate_hit_test()
+  
+  def __pick_cpu(self, x, y):
+    if not self.children:
+      return []
+    # the layer itself is not a `SmartNode`, so it's
+    # never included in the resulting chain
+    point = euclid.Point2(x, y)
+    if self.parent is not None: # e. g. transformed scene
+      point = self.parent.get_world_inverse() * point
+    chain = _pick(self, point)
+    return reverse(chain or [])
+  
+  def __pick_gl(self, x, y):
     if not self.children:
       return []
     
-    # TODO simple rectangular check to improve performance
     viewport = GL.glGetIntegerv(GL.GL_VIEWPORT)
     GL.glSelectBuffer(512)
     GL.glRenderMode(GL.GL_SELECT)
@@ -122,31 +215,22 @@ class SmartLayer(cocos.layer.base_layers.Layer):
     GL.glPopMatrix()
     GL.glMatrixMode(GL.GL_MODELVIEW)
     
-    old_result = self.highlighted
-    new_result = list(result)
-    self.highlighted = new_result
-    for obj in set(old_result) - set(new_result):
-      obj.mouse_out()
-    for obj in set(new_result) - set(old_result):
-      obj.mouse_enter()
-    
-    self.highlighted.reverse()
-    
+    return reverse(result)
   
   def on_mouse_motion(self, x, y, dx, dy):
-    self.__mouse_position = (x, y)
+    self.__move_mouse(x, y)
     for obj in self.highlighted:
       if obj.mouse_motion(x, y, dx, dy) == False:
         break
   
   def on_mouse_drag(self, x, y, dx, dy, button, modifiers):
-    self.__mouse_position = (x, y)
+    self.__move_mouse(x, y)
     for obj in self.highlighted:
       if obj.mouse_drag(x, y, dx, dy, button, modifiers) == False:
         break
   
   def on_mouse_press(self, x, y, button, modifiers):
-    self.__mouse_position = (x, y)
+    self.__move_mouse(x, y)
     old_focused = self.focused
     new_focused = (self.highlighted or [None])[0]
     if old_focused != new_focused:
@@ -166,7 +250,7 @@ class SmartLayer(cocos.layer.base_layers.Layer):
       return True
   
   def on_mouse_release(self, x, y, button, modifiers):
-    self.__mouse_position = (x, y)
+    self.__move_mouse(x, y)
     for obj in self.highlighted:
       if obj.mouse_release(x, y, button, modifiers) == False:
         break
@@ -183,6 +267,49 @@ class SmartLayer(cocos.layer.base_layers.Layer):
       self.focused.key_release(key, modifiers)
       return True
   
+  def update_hit_test(self):
+    """Recomputes objects under cursor if needed
+    (see `invalidate_hit_test`)."""
+    if self.__hit_test_dirty:
+      self.__hit_test_dirty = False
+      self.objects_under_cursor(*self.__mouse_position)
+  
   def visit(self):
-    self.objects_under_cursor(*self.__mouse_position)
+    self.update_hit_test()
     super(SmartLayer, self).visit()
+
+
+def _pick(node, point):
+  """Returns chain of `SmartNode`s (outermost first) leading
+  to the topmost object under `point`, which is given in
+  coordinates of `node`'s parent, or None if nothing is hit.
+  
+  Nodes are tested in reverse drawing order, just like
+  `CocosNode.visit` would draw them, so the first hit is
+  the one that would be visible on the screen.
+  """
+  if not node.visible:
+    return None
+  local = node.get_local_inverse() * point
+  children = node.children
+  position = 0
+  while position < len(children) and children[position][0] < 0:
+    position += 1
+  chain = None
+  for z, child in reverse(children[position:]):
+    chain = _pick(child, local)
+    if chain is not None:
+      break
+  if chain is None:
+    if isinstance(node, SmartNode) and node.hit_test(local.x, local.y):
+      chain = []
+    else:
+      for z, child in reverse(children[:position]):
+        chain = _pick(child, local)
+        if chain is not None:
+          break
+  if chain is None:
+    return None
+  if isinstance(node, SmartNode):
+    chain.insert(0, node)
+  return chain
@@ -1,5 +1,3 @@
-# OpenGL
-from OpenGL import GL
 # pyglet
 import pyglet
 # gui
@@ -17,15 +15,12 @@ class Button(GUINode):
   
   def draw(self, *args, **kwargs):
     super(Button, self).draw(*args, **kwargs)
-    GL.glPushMatrix()
-    self.transform()
-    self.text_label.draw()
-    GL.glPopMatrix()
+    if not self.texts_batched:
+      self.text_label.draw()
   
   def apply_style(self, **options):
     super(Button, self).apply_style(**options)
-    tl = self.text_label
-    tl.x, tl.y, tl.width, tl.height = self.content_box
+    self.place_texts()
   
   @property
   def text(self):
@@ -34,6 +29,7 @@ class Button(GUINode):
   @text.setter
   def text(self, value):
     self.text_label.text = value
+    self.invalidate_geometry()
   
   def mouse_release(self, *args):
     super(Button, self).mouse_release(*args)
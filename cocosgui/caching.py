@@ -0,0 +1,272 @@
+# built-in
+import math
+# PyOpenGL
+from OpenGL import GL
+# pyglet
+import pyglet
+# cocos2d
+from cocos.director import director
+from cocos.framegrabber import TextureGrabber
+# gui
+from .spatial import contains, intersects, intersection, union
+
+# hits and misses of all `TextureCache`s
+stats = {'hits': 0, 'misses': 0}
+
+# caches currently rendering into their textures, innermost last
+_rendering = []
+
+def _blend_into_texture():
+  """Sets blending for rendering into a cache's texture: its
+  colors get premultiplied by alpha, so that the texture can be
+  blitted with `_blend_texture` (alpha isn't applied twice)."""
+  GL.glEnable(GL.GL_BLEND)
+  GL.glBlendFuncSeparate(GL.GL_SRC_ALPHA, GL.GL_ONE_MINUS_SRC_ALPHA,
+                         GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA)
+
+def _blend_texture():
+  """Sets blending for drawing a premultiplied texture."""
+  GL.glEnable(GL.GL_BLEND)
+  GL.glBlendFunc(GL.GL_ONE, GL.GL_ONE_MINUS_SRC_ALPHA)
+
+def gl_matrix(matrix):
+  """Converts euclid's `Matrix3` of a 2D transformation
+  to a list suitable for `glMultMatrixf`."""
+  return [matrix.a, matrix.e, 0, 0,
+          matrix.b, matrix.f, 0, 0,
+          0,        0,        1, 0,
+          matrix.c, matrix.g, 0, 1]
+
+
+class TextureCache(object):
+  """Keeps `GUINode`'s subtree rendered into a texture, so
+  that it is drawn as a single textured quad until something
+  in the subtree changes (see `GUINode.invalidate_cache`).
+  
+  Used for nodes having `cache: texture` style. Only node's
+  `border_box` is cached, so the subtree shouldn't overflow
+  it. Nodes using scissor test (like `TextEdit`) won't be
+  drawn properly inside a cached subtree.
+  
+  It can be rendered while other cache (e. g. `LayerCache`)
+  is rendering, if it isn't clipped at the moment.
+  """
+  
+  def __init__(self):
+    self.valid = False
+    self.hits = 0
+    self.misses = 0
+    self.__grabber = None
+    self.__texture = None
+    self.__region = None
+  
+  def invalidate(self):
+    self.valid = False
+  
+  def visit(self, node, visit):
+    """Draws `node`'s subtree, `visit` being the usual
+    (not cached) way of doing it."""
+    if not self.valid and _rendering and not self.__visible(node):
+      # only a part of the subtree would be rendered
+      # while other cache redraws a part of its texture
+      visit()
+      return
+    if self.valid:
+      self.hits += 1
+      stats['hits'] += 1
+    else:
+      self.misses += 1
+      stats['misses'] += 1
+      self.__render(node, visit)
+    left, bottom = node.border_box[:2]
+    GL.glPushMatrix()
+    node.transform()
+    GL.glPushAttrib(GL.GL_COLOR_BUFFER_BIT)
+    _blend_texture()
+    self.__region.blit(left, bottom)
+    GL.glPopAttrib()
+    GL.glPopMatrix()
+  
+  def __visible(self, node):
+    window = node.window
+    clip_rect = window.clip_rect if window is not None else None
+    return clip_rect is None or contains(clip_rect, node.world_border_box)
+  
+  def resume(self):
+    """Makes drawing go to the texture again after
+    a nested cache was rendered."""
+    self.__grabber.fbuf.bind()
+  
+  def __render(self, node, visit):
+    left, bottom, width, height = map(int, node.border_box)
+    width, height = max(width, 1), max(height, 1)
+    if self.__region is None or \
+       (self.__region.width, self.__region.height) != (width, height):
+      self.__texture = pyglet.image.Texture.create_for_size(
+        GL.GL_TEXTURE_2D, width, height, GL.GL_RGBA)
+      self.__region = self.__texture.get_region(0, 0, width, height)
+      self.__grabber = TextureGrabber()
+      self.__grabber.grab(self.__texture)
+    
+    GL.glPushAttrib(GL.GL_VIEWPORT_BIT | GL.GL_SCISSOR_BIT |
+                    GL.GL_COLOR_BUFFER_BIT)
+    GL.glDisable(GL.GL_SCISSOR_TEST) # e. g. of outer `LayerCache`
+    _blend_into_texture()
+    GL.glMatrixMode(GL.GL_PROJECTION)
+    GL.glPushMatrix()
+    GL.glLoadIdentity()
+    GL.glOrtho(0, width, 0, height, -1, 1)
+    GL.glMatrixMode(GL.GL_MODELVIEW)
+    GL.glPushMatrix()
+    GL.glLoadIdentity()
+    # node's border box goes to the texture's origin, and
+    # node's own transformation (applied by `visit`) is undone
+    GL.glTranslatef(-left, -bottom, 0)
+    GL.glMultMatrixf(gl_matrix(node.get_local_inverse()))
+    GL.glViewport(0, 0, width, height)
+    self.__grabber.before_render(self.__texture)
+    _rendering.append(self)
+    try:
+      visit()
+    finally:
+      _rendering.pop()
+      self.__grabber.after_render(self.__texture)
+      if _rendering:
+        _rendering[-1].resume()
+      GL.glMatrixMode(GL.GL_PROJECTION)
+      GL.glPopMatrix()
+      GL.glMatrixMode(GL.GL_MODELVIEW)
+      GL.glPopMatrix()
+      GL.glPopAttrib()
+    self.valid = True
+
+
+class LayerCache(object):
+  """Keeps the whole `GUILayer` rendered into a texture, and
+  redraws only outdated rectangles of it (using scissor test),
+  see `GUILayer.dirty_rendering`.
+  
+  `repainted` is the fraction of the layer's area redrawn
+  during the last frame.
+  """
+  
+  # if there are more outdated rectangles (after merging
+  # overlapping ones), their bounding rectangle is redrawn
+  max_rects = 8
+  
+  def __init__(self):
+    self.rects = [] # outdated rectangles, in world coordinates
+    self.full = True # True if the whole layer is outdated
+    self.repainted = 0.
+    self.__grabber = None
+    self.__texture = None
+  
+  def invalidate(self, rect):
+    """Marks `rect`, given in world coordinates, outdated."""
+    if not self.full:
+      self.rects.append(rect)
+  
+  def invalidate_all(self):
+    self.full = True
+    self.rects = []
+  
+  def visit(self, layer, visit):
+    """Draws `layer`, `visit` being the usual (not cached)
+    way of doing it."""
+    width, height = director.get_window_size()
+    if self.__texture is None or \
+       (self.__texture.width, self.__texture.height) != (width, height):
+      self.__texture = pyglet.image.Texture.create_for_size(
+        GL.GL_TEXTURE_2D, width, height, GL.GL_RGBA)
+      self.__grabber = TextureGrabber()
+      self.__grabber.grab(self.__texture)
+      self.invalidate_all()
+    bounds = (0, 0, width, height)
+    if self.full:
+      rects = [bounds]
+    else:
+      rects = merge_rects(self.rects, bounds, self.max_rects)
+    self.full, self.rects = False, []
+    self.repainted = sum(w * h for x, y, w, h in rects) / float(width * height)
+    # world coordinates are texture's pixels while redrawing
+    parent = layer.parent
+    if rects:
+      GL.glPushAttrib(GL.GL_VIEWPORT_BIT | GL.GL_SCISSOR_BIT |
+                      GL.GL_COLOR_BUFFER_BIT)
+      _blend_into_texture()
+      GL.glMatrixMode(GL.GL_PROJECTION)
+      GL.glPushMatrix()
+      GL.glLoadIdentity()
+      GL.glOrtho(0, width, 0, height, -1, 1)
+      GL.glMatrixMode(GL.GL_MODELVIEW)
+      GL.glPushMatrix()
+      GL.glLoadIdentity()
+      if parent is not None:
+        GL.glMultMatrixf(gl_matrix(parent.get_world_transform()))
+      GL.glViewport(0, 0, width, height)
+      GL.glEnable(GL.GL_SCISSOR_TEST)
+      _rendering.append(self)
+      try:
+        for rect in rects:
+          GL.glScissor(*rect)
+          # clears just the scissor box
+          self.__grabber.before_render(self.__texture)
+          try:
+            with layer.clip(rect): # nodes outside aren't visited
+              visit()
+          finally:
+            self.__grabber.after_render(self.__texture)
+      finally:
+        _rendering.pop()
+        GL.glMatrixMode(GL.GL_PROJECTION)
+        GL.glPopMatrix()
+        GL.glMatrixMode(GL.GL_MODELVIEW)
+        GL.glPopMatrix()
+        GL.glPopAttrib()
+    GL.glPushMatrix()
+    if parent is not None:
+      GL.glMultMatrixf(gl_matrix(parent.get_world_inverse()))
+    GL.glPushAttrib(GL.GL_COLOR_BUFFER_BIT)
+    _blend_texture()
+    self.__texture.blit(0, 0)
+    GL.glPopAttrib()
+    GL.glPopMatrix()
+  
+  def resume(self):
+    """See `TextureCache.resume`."""
+    self.__grabber.fbuf.bind()
+
+
+def merge_rects(rects, bounds, limit=None):
+  """Clips `rects` to `bounds` and rounds them to whole
+  pixels (outwards), merging overlapping ones into their
+  bounding rectangles. If more than `limit` rectangles are
+  left, returns just the bounding rectangle of all of them.
+  
+  >>> merge_rects([(0, 0, 10, 10), (5, 5, 10, 10.5)], (0, 0, 100, 100))
+  [(0, 0, 15, 16)]
+  """
+  result = []
+  for rect in rects:
+    rect = _clip_rect(rect, bounds)
+    if rect is None:
+      continue
+    merged = True
+    while merged:
+      merged = False
+      for other in result:
+        if intersects(rect, other):
+          result.remove(other)
+          rect = union(rect, other)
+          merged = True
+          break
+    result.append(rect)
+  if limit is not None and len(result) > limit:
+    result = [reduce(union, result)]
+  return result
+
+def _clip_rect(rect, bounds):
+  left,  bottom = int(math.floor(rect[0])), int(math.floor(rect[1]))
+  right, top    = (int(math.ceil(rect[0] + rect[2])),
+                   int(math.ceil(rect[1] + rect[3])))
+  return intersection((left, bottom, right - left, top - bottom), bounds)
@@ -1,69 +1,146 @@
 __all__ = [
   'styles', 'Style', 'CSSNode',
-  'evaluate'
+  'evaluate', 'update', 'count_rules'
 ]
 
+# built-in
+import heapq
+
 # importing basic names to publish them
-from .style import styles, Style
-from .node import CSSNode
+from .style import styles, Style, SidedStylesContainer, compile_property
+from .node import CSSNode, count_rules
 # importing extensions
 import border, borderimage, background, font
 import rendering
 
 def evaluate(window, element = None):
+  """Evaluates styles and boxes of the whole `element`'s subtree."""
   if element is None:
     element = window
-  element.evaluate_style()
+  _restyle(element)
   children = element.get_nodes()
   for child in children:
     assert(child.parent is element)
     evaluate(window, child)
   _evaluate_node(element)
 
+def update(window, nodes):
+  """Brings outdated `nodes` up to date, re-evaluating only
+  what is necessary (see `CSSNode.style_dirty` and
+  `CSSNode.layout_dirty`). Node is laid out again if its style,
+  content or children changed; its parent is laid out again
+  only if node's size changed. Changes of paint properties
+  (see `Style.paint_properties`) need no layout at all.
+  """
+  nodes = sorted(nodes, key=_depth) # parents go first
+  # restyling
+  relayout = set()
+  for node in nodes:
+    if not hasattr(node, 'margin_box'):
+      relayout.add(node) # never evaluated, see below
+    elif node.style_dirty:
+      _restyle_changed(node, relayout)
+    elif node.layout_dirty:
+      relayout.add(node)
+  # relayout, from the deepest nodes up
+  queue = [(-_depth(node), node) for node in relayout]
+  heapq.heapify(queue)
+  done = set()
+  while queue:
+    depth, node = heapq.heappop(queue)
+    if node in done:
+      continue
+    done.add(node)
+    if hasattr(node, 'margin_box'):
+      old_size = node.margin_box[2:]
+      for child in node.get_nodes():
+        if not hasattr(child, 'margin_box'): # e. g. just added
+          evaluate(window, child)
+      _evaluate_node(node)
+      resized = (node.margin_box[2:] != old_size)
+    else:
+      evaluate(window, node)
+      resized = True
+    parent = node.parent
+    if resized and isinstance(parent, CSSNode):
+      heapq.heappush(queue, (depth + 1, parent))
+
+def _depth(node):
+  depth = 0
+  node = node.parent
+  while node is not None:
+    depth += 1
+    node = node.parent
+  return depth
+
+def _restyle(node):
+  node.evaluate_style()
+  node.evaluated_style.inherit(node)
+  node.style_dirty = False
+
+def _restyle_changed(node, relayout):
+  """Restyles `node`, and its descendants too if inherited
+  values changed. Adds nodes needing layout to `relayout`;
+  others are just prepared for repainting."""
+  old_style = node.evaluated_style
+  _restyle(node)
+  style = node.evaluated_style
+  changed = style.changed_properties(old_style)
+  paint_only = Style.paint_properties.issuperset(changed)
+  if node.layout_dirty or not paint_only:
+    relayout.add(node)
+  else: # boxes are still valid
+    node.repaint()
+  if style.font.resolved != old_style.font.resolved:
+    for child in node.get_nodes():
+      if hasattr(child, 'margin_box'):
+        _restyle_changed(child, relayout)
+
+# precompiled accessors for `_evaluate_node`
+_sides = SidedStylesContainer.subnames # top, right, bottom, left
+_left, _top, _position = map(compile_property, ['left', 'top', 'position'])
+_margin_top, _margin_right, _margin_bottom, _margin_left = [
+  compile_property('margin-' + side) for side in _sides]
+_border_top, _border_right, _border_bottom, _border_left = [
+  compile_property('border-%s-width' % side) for side in _sides]
+_padding_top, _padding_right, _padding_bottom, _padding_left = [
+  compile_property('padding-' + side) for side in _sides]
+
 def _evaluate_node(node):
   parent, style = node.parent, node.evaluated_style
-  left, bottom = style['left'], style['top']
+  left, bottom = _left(style), _top(style)
   left   = 0 if left   == 'auto' else left
   bottom = 0 if bottom == 'auto' else bottom
-  position = style['position']
+  position = _position(style)
   if position == 'absolute':
     raise NotImplementedError
   # TODO fixed?
+  margin_left,  margin_right  = _margin_left (style), _margin_right (style)
+  margin_top,   margin_bottom = _margin_top  (style), _margin_bottom(style)
+  border_left,  border_right  = _border_left (style), _border_right (style)
+  border_top,   border_bottom = _border_top  (style), _border_bottom(style)
+  padding_left, padding_right = _padding_left(style), _padding_right(style)
+  padding_top, padding_bottom = _padding_top (style), _padding_bottom(style)
   margin_offset  = [left, bottom]
-  border_offset  = [margin_offset[0] + style['margin-left'],
-                    margin_offset[1] + style['margin-bottom' ]]
-  padding_offset = [border_offset[0] + style['border-left-width'],
-                    border_offset[1] + style['border-bottom-width' ]]
-  content_offset = [padding_offset[0] + style['padding-left'],
-                    padding_offset[1] + style['padding-bottom' ]]
+  border_offset  = [margin_offset[0] + margin_left,
+                    margin_offset[1] + margin_bottom]
+  padding_offset = [border_offset[0] + border_left,
+                    border_offset[1] + border_bottom]
+  content_offset = [padding_offset[0] + padding_left,
+                    padding_offset[1] + padding_bottom]
   content_box = content_offset + list(node.get_content_size())
-  padding_box = padding_offset + [sum((
-    content_box[2],
-    style['padding-left'  ],
-    style['padding-right' ],
-  )), sum((
-    content_box[3],
-    style['padding-top'   ],
-    style['padding-bottom'],
-  ))]
-  border_box = border_offset + [sum((
-    padding_box[2],
-    style['border-left-width'  ],
-    style['border-right-width' ],
-  )), sum((
-    padding_box[3],
-    style['border-top-width'   ],
-    style['border-bottom-width'],
-  ))]
-  margin_box = margin_offset + [sum((
-    border_box[2],
-    style['margin-left'  ],
-    style['margin-right' ],
-  )), sum((
-    border_box[3],
-    style['margin-top'   ],
-    style['margin-bottom'],
-  ))]
+  padding_box = padding_offset + [
+    content_box[2] + padding_left + padding_right,
+    content_box[3] + padding_top  + padding_bottom,
+  ]
+  border_box = border_offset + [
+    padding_box[2] + border_left + border_right,
+    padding_box[3] + border_top  + border_bottom,
+  ]
+  margin_box = margin_offset + [
+    border_box[2] + margin_left + margin_right,
+    border_box[3] + margin_top  + margin_bottom,
+  ]
   #width, height = style['width'], style['height'] # TODO percentages?
   #width  = margin_box[2] if width  == 'auto' else width
   #height = margin_box[3] if height == 'auto' else height
@@ -80,3 +157,4 @@ def _evaluate_node(node):
     'content_box': content_box,
   }
   node.apply_style(**info)
+  node.layout_dirty = False
@@ -0,0 +1,81 @@
+"""Texture atlases for small GUI images (backgrounds and
+border images), so that skinned widgets share a few textures
+instead of binding their own ones.
+
+Disabled by default; call `enable()` once there is a GL
+context, then `get_texture` returns regions of atlases.
+"""
+# pyglet
+from pyglet.image.atlas import TextureAtlas, AllocatorException
+
+
+class AtlasManager(object):
+  """Packs images not larger than `max_size` into atlases of
+  `width`x`height`, creating new atlases as needed.
+  
+  >>> manager = AtlasManager()
+  >>> region = manager.get_texture(image)
+  >>> region.id == manager.atlases[0].texture.id
+  True
+  """
+  
+  def __init__(self, width=512, height=512, max_size=128):
+    self.width = width
+    self.height = height
+    self.max_size = max_size
+    self.atlases = []
+    self.__regions = {} # image -> region
+  
+  def get_texture(self, image):
+    """Returns texture to draw `image` with: region of an
+    atlas or, if `image` doesn't fit, its own texture."""
+    region = self.__regions.get(image)
+    if region is None:
+      region = self.__regions[image] = self.__add(image)
+    return region
+  
+  def __add(self, image):
+    if image.width > self.max_size or image.height > self.max_size:
+      return image.get_texture()
+    data = image.get_image_data()
+    for atlas in self.atlases:
+      try:
+        return atlas.add(data)
+      except AllocatorException:
+        pass # trying the next one
+    atlas = TextureAtlas(self.width, self.height)
+    self.atlases.append(atlas)
+    try:
+      return atlas.add(data)
+    except AllocatorException:
+      return image.get_texture()
+  
+  def usage(self):
+    """Returns list of `(texture, used, fragmentation)` for
+    each atlas, where `used` is the fraction of its allocated
+    area, and `fragmentation` is the fraction of area that is
+    unlikely to be ever used."""
+    return [(atlas.texture,
+             atlas.allocator.get_usage(),
+             atlas.allocator.get_fragmentation())
+            for atlas in self.atlases]
+
+
+# `AtlasManager` used for drawing, if enabled
+manager = None
+
+def enable(*args, **kwargs):
+  """Makes images to be packed into atlases (arguments
+  are the same as for `AtlasManager`)."""
+  global manager
+  manager = AtlasManager(*args, **kwargs)
+
+def disable():
+  global manager
+  manager = None
+
+def get_texture(image):
+  """Returns texture to draw `image` with."""
+  if manager is None:
+    return image.get_texture()
+  return manager.get_texture(image)
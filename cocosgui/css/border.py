@@ -4,6 +4,7 @@ from collections import defaultdict
 from .utility import to_words, from_words
 from .utility import expand_sided_value, collapse_sided_value
 from .style import styles, Style, StylesContainer, SidedStylesContainer
+from .color import to_color
 
 
 class BorderSide(StylesContainer):
@@ -11,6 +12,7 @@ class BorderSide(StylesContainer):
   subnames = [
     'color', 'style', 'width', #'radius'
   ]
+  converters = {'color': to_color}
   
   def __init__(self, side, *args, **kwargs):
     super(BorderSide, self).__init__(*args, **kwargs)
@@ -37,7 +39,7 @@ class Border(SidedStylesContainer):
   >>> b = Border()
   >>> b['border-color'] = '#FFBBFF'
   >>> b['border-left-color']
-  '#FFBBFF'
+  (255, 187, 255, 255)
   """
   prefix = 'border'
   defaults = {
@@ -92,4 +94,6 @@ class Border(SidedStylesContainer):
 _default_border = Border((0, 'none', 'transparent'))
 Style.subnames.append('border')
 Style.defaults['border'] = Border
+Style.paint_properties.update('border-%s-%s' % (side, subname)
+  for side in Border.sides for subname in ('color', 'style'))
 styles['*'].set_by_subname('border', _default_border)
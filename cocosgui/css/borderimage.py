@@ -1,5 +1,5 @@
 from .utility import expand_sided_value, expand_hv_value
-from .style import styles, StylesContainer
+from .style import styles, Style, StylesContainer
 
 
 class BorderImage(StylesContainer):
@@ -66,6 +66,8 @@ class BorderImage(StylesContainer):
 from .border import Border
 Border.subnames.append('image')
 Border.defaults['image'] = BorderImage
+Style.paint_properties.update(
+  'border-image-' + subname for subname in BorderImage.subnames)
 _default_border = styles['*'].border
 _default_border.set_by_subname('image', BorderImage({
   'source': 'none',
@@ -1,4 +1,5 @@
-import re, colorsys
+import re, colorsys, struct
+from collections import OrderedDict
 
 _float = '(?:[-+]?(?:\d*\.\d+|\d+\.\d*|\d+)(?:[eE][-+]?\d+)?)'
 
@@ -183,63 +184,124 @@ _named_colors = {
 }
 
 
+def _parse(s):
+  """Parses CSS color, returning `(r, g, b, a)` tuple."""
+  if isinstance(s, (tuple, list)):
+    if len(s) not in (3, 4):
+      raise ValueError('Invalid CSS color: %r' % (s,))
+    s = map(_clamp_to_ubyte, s)
+    if len(s) == 3:
+      s.append(255) # default alpha value
+    return tuple(s)
+  if not isinstance(s, basestring):
+    raise TypeError('Invalid CSS color value: %r' % s)
+  s = s.lower().strip()
+  ## checking simple names ##
+  if s in _named_colors:
+    return _named_colors[s]
+  try:
+    a = 255 # default alpha value
+    ## checking hex RGB triple ##
+    hex_match = _hex_color.match(s)
+    if hex_match is not None:
+      hex_color = hex_match.group(1)
+      if len(hex_color) == 6:
+        r = int(hex_color[0:2], 16)
+        g = int(hex_color[2:4], 16)
+        b = int(hex_color[4:6], 16)
+      elif len(hex_color) == 3:
+        r = int(hex_color[0], 16) * (16 + 1)
+        g = int(hex_color[1], 16) * (16 + 1)
+        b = int(hex_color[2], 16) * (16 + 1)
+      else:
+        assert False, '`_hex_color` regexp seems to be invalid.'
+      return (r, g, b, a)
+    ## checking RGB
+    rgb_match = _rgb_color.match(s)
+    if rgb_match is not None:
+      r, g, b = map(_raw_to_ubyte, rgb_match.groups())
+      return (r, g, b, a)
+    ## checking RGBA ##
+    rgba_match = _rgba_color.match(s)
+    if rgba_match is not None:
+      r, g, b, a = rgba_match.groups()
+      r, g, b = map(_raw_to_ubyte, (r, g, b))
+      a = int(float(a) * 255 + 0.5)
+      return (r, g, b, a)
+    ## checking HSL ##
+    hsl_match = _hsl_color.match(s)
+    if hsl_match is not None:
+      h, s, l = map(int, hsl_match.groups())
+      r, g, b = hsl_to_rgb(h, s, l)
+      return (r, g, b, a)
+    ## checking HSLA ##
+    hsla_match = _hsla_color.match(s)
+    if hsla_match is not None:
+      h, s, l, a = hsla_match.groups()
+      r, g, b = hsl_to_rgb(int(h), int(s), int(l))
+      a = int(float(a) * 255 + 0.5)
+      return (r, g, b, a)
+    # nothing worked
+    raise ValueError
+  except ValueError:
+    raise ValueError('Invalid CSS color: %r' % s)
+
+
+class _LRUCache(object):
+  def __init__(self, size):
+    self.size = size
+    self.items = OrderedDict()
+  
+  def get(self, key):
+    try:
+      value = self.items.pop(key)
+    except KeyError:
+      return None
+    self.items[key] = value # moving to the end
+    return value
+  
+  def set(self, key, value):
+    self.items.pop(key, None)
+    self.items[key] = value
+    if len(self.items) > self.size:
+      self.items.popitem(last=False) # least recently used
+
+# parsed colors, keyed both by original values and
+# by RGBA tuples (so equal colors are the same object)
+_colors = _LRUCache(1024)
+
+
 class Color(tuple):
+  """Immutable RGBA color. Colors are interned, so parsing
+  the same value again is just a cache lookup.
+  
+  >>> Color('#F00') is Color('red')
+  True
+  >>> Color('red').packed == 0xFF0000FF
+  True
+  """
+  
   def __new__(cls, s):
-    if isinstance(s, (tuple, list)):
-      s = map(_clamp_to_ubyte, s)
-      return tuple.__new__(cls, s)
-    if not isinstance(s, basestring):
-      raise TypeError('Invalid CSS color value: %r' % s)
-    s = s.lower().strip()
-    ## checking simple names ##
-    if s in _named_colors:
-      return cls.__new__(cls, _named_colors[s])
+    if isinstance(s, Color):
+      return s # already parsed
+    if isinstance(s, list):
+      s = tuple(s)
     try:
-      a = 255 # default alpha value
-      ## checking hex RGB triple ##
-      hex_match = _hex_color.match(s)
-      if hex_match is not None:
-        hex_color = hex_match.group(1)
-        if len(hex_color) == 6:
-          r = int(hex_color[0:2], 16)
-          g = int(hex_color[2:4], 16)
-          b = int(hex_color[4:6], 16)
-        elif len(hex_color) == 3:
-          r = int(hex_color[0], 16) * (16 + 1)
-          g = int(hex_color[1], 16) * (16 + 1)
-          b = int(hex_color[2], 16) * (16 + 1)
-        else:
-          assert False, '`_hex_color` regexp seems to be invalid.'
-        return tuple.__new__(cls, (r, g, b, a))
-      ## checking RGB
-      rgb_match = _rgb_color.match(s)
-      if rgb_match is not None:
-        r, g, b = map(_raw_to_ubyte, rgb_match.groups())
-        return tuple.__new__(cls, (r, g, b, a))
-      ## checking RGBA ##
-      rgba_match = _rgba_color.match(s)
-      if rgba_match is not None:
-        r, g, b, a = rgba_match.groups()
-        r, g, b = map(_raw_to_ubyte, (r, g, b))
-        a = int(float(a) * 255 + 0.5)
-        return tuple.__new__(cls, (r, g, b, a))
-      ## checking HSL ##
-      hsl_match = _hsl_color.match(s)
-      if hsl_match is not None:
-        h, s, l = map(int, hsl_match.groups())
-        r, g, b = hsl_to_rgb(h, s, l)
-        return tuple.__new__(cls, (r, g, b, a))
-      ## checking HSLA ##
-      hsla_match = _hsla_color.match(s)
-      if hsla_match is not None:
-        h, s, l, a = hsla_match.groups()
-        r, g, b = hsl_to_rgb(int(h), int(s), int(l))
-        a = int(float(a) * 255 + 0.5)
-        return tuple.__new__(cls, (r, g, b, a))
-      # nothing worked
-      raise ValueError
-    except ValueError:
-      raise ValueError('Invalid CSS color: %r' % s)
+      color = _colors.get(s)
+    except TypeError: # unhashable
+      raise TypeError('Invalid CSS color value: %r' % s)
+    if color is None:
+      rgba = tuple(_parse(s))
+      color = _colors.get(rgba)
+      if color is None:
+        color = tuple.__new__(cls, rgba)
+        r, g, b, a = rgba
+        # forms suitable for vertex arrays
+        color.packed = (r << 24) | (g << 16) | (b << 8) | a
+        color.rgba_bytes = struct.pack('4B', *rgba)
+        _colors.set(rgba, color)
+      _colors.set(s, color)
+    return color
   
   def is_transparent(self):
     return (self.alpha == 0)
@@ -263,3 +325,15 @@ class Color(tuple):
 
 
 _named_colors = {k.lower(): Color(v) for k, v in _named_colors.items()}
+
+
+# values allowed for color properties which aren't colors
+_color_keywords = frozenset(['inherit', 'initial', 'currentcolor'])
+
+def to_color(value):
+  """Normalizes value written to a color property: returns
+  `Color` or, for keywords like 'inherit', the value as is.
+  """
+  if isinstance(value, basestring) and value.lower() in _color_keywords:
+    return value
+  return Color(value)
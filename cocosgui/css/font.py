@@ -1,7 +1,7 @@
 # css
 from .style import styles, Style, StylesContainer
 from .node import CSSNode
-from .color import Color
+from .color import Color, to_color
 
 # TODO letter-spacing (simple Letter class, use pyglet's
 # `document.style['kerning']`)
@@ -23,6 +23,10 @@ _font_weights = {
   'bold'  : 700,
 }
 
+# resolved font (see `Font.get_resolved`) of nodes having no
+# parent to inherit from
+_initial_resolved = ('', _font_sizes['medium'], False, False, Color('black'))
+
 class Font(StylesContainer):
   prefix = 'font'
   subnames = [
@@ -36,27 +40,53 @@ class Font(StylesContainer):
   
   # TODO set_to_value, get_as_value
   
+  def __init__(self, *args, **kwargs):
+    super(Font, self).__init__(*args, **kwargs)
+    self.resolved = None
+  
+  def clone(self):
+    result = super(Font, self).clone()
+    result.resolved = None
+    return result
+  
+  def inherit(self, node):
+    super(Font, self).inherit(node)
+    self.resolved = (
+      self.__evaluate_family(node),
+      self.__evaluate_size  (node),
+      self.__evaluate_weight(node),
+      self.__evaluate_style (node),
+      self.__evaluate_color (node),
+    )
+  
+  def get_resolved(self, node):
+    """Returns `(family, size, bold, italic, color)` tuple
+    for `node`. Normally it is computed by `inherit` during
+    top-down evaluation, so this is just a lookup.
+    """
+    if self.resolved is None:
+      self.inherit(node)
+    return self.resolved
+  
+  def __parent_resolved(self, node):
+    parent = node.parent
+    if isinstance(parent, CSSNode):
+      return parent.evaluated_style.font.get_resolved(parent)
+    return _initial_resolved # e. g. a detached subtree
+  
   def __evaluate_size(self, node):
     size = self.size
     try:
       if isinstance(size, basestring):
         size = size.lower()
         if size == 'inherit':
-          parent = node.parent
-          if isinstance(parent, CSSNode):
-            size = parent.evaluated_style.font.__evaluate_size(parent)
-          else:
-            raise ValueError('Can\'t inherit font-size from %r' % parent)
+          size = self.__parent_resolved(node)[1]
         else:
           size = _font_sizes[size]
       elif isinstance(size, int): # TODO px, em, pt classes
         pass # it's OK
       elif isinstance(size, float): # TODO percentage class!
-        parent = node.parent
-        if isinstance(parent, CSSNode):
-          size *= 0.01 * parent.evaluated_style.font.__evaluate_size(parent)
-        else:
-          raise ValueError('Can\'t inherit font-size from %r' % parent)
+        size *= 0.01 * self.__parent_resolved(node)[1]
       return size
     except KeyError:
       raise ValueError('Unsupported font-size: %r' % size)
@@ -66,11 +96,7 @@ class Font(StylesContainer):
     if isinstance(weight, basestring):
       weight = weight.lower()
       if weight == 'inherit':
-        parent = node.parent
-        if isinstance(parent, CSSNode):
-          return parent.evaluated_style.font.__evaluate_weight(parent)
-        else:
-          raise ValueError('Can\'t inherit font-weight from %r' % parent)
+        return self.__parent_resolved(node)[2]
       # TODO implement `lighter`, `bolder`
       else:
         weight = _font_weights.get(weight, -100)
@@ -85,35 +111,56 @@ class Font(StylesContainer):
     elif style in ('italic', 'oblique'):
       return True
     elif style in ('inherit',):
-      parent = node.parent
-      if isinstance(parent, CSSNode):
-        return parent.evaluated_style.font.__evaluate_style(parent)
-      else:
-        raise ValueError('Can\'t inherit font-style from %r' % parent)
+      return self.__parent_resolved(node)[3]
   
   def __evaluate_family(self, node):
     # TODO smart function, testing fonts for existance,
     # handling `inherit` value properly, etc.
     return self.family
   
+  def __evaluate_color(self, node):
+    color = node.evaluated_style['color']
+    if isinstance(color, basestring):
+      keyword = color.lower()
+      # `currentcolor` of `color` itself means `inherit`
+      if keyword in ('inherit', 'currentcolor'):
+        return self.__parent_resolved(node)[4]
+      elif keyword == 'initial':
+        return _initial_resolved[4]
+    return Color(color)
+  
   # TODO TODO TODO Find a nice way to call this function.
   # Change `CSSNode.apply_style`, maybe?
   def apply_to(self, node):
     super(Font, self).apply_to(node)
-    if not hasattr(node, 'text_objects'):
+    if not getattr(node, 'text_objects', None) or \
+       not getattr(node, 'styled_texts', True):
       return # nothing to change
-    family = self.__evaluate_family(node)
-    size   = self.__evaluate_size  (node)
-    weight = self.__evaluate_weight(node)
-    style  = self.__evaluate_style (node)
-    color  = Color(node.evaluated_style['color'])
+    family, size, weight, style, color = self.get_resolved(node)
+    values = {
+      'font_size': size,
+      'italic': style,
+      'bold': weight,
+      'color': color,
+    }
+    if family:   # HACK complete __evaluate_family and
+      values['font_name'] = family # you won't need this `if`
     for obj in node.text_objects:
-      if family:   # HACK complete __evaluate_family and
-        obj.font_name = family # you won't need this `if`
-      obj.font_size = size
-      obj.italic = style
-      obj.bold = weight
-      obj.color = color
+      document = obj.document
+      # each property setter of pyglet's label lays the text out
+      # again, so changed values are set at once (if any)
+      changed = dict((name, value) for name, value in values.items()
+                     if document.get_style(name) != value)
+      if not changed:
+        continue
+      if set(changed) == set(['color']):
+        # pyglet only recolors vertices in this case, while
+        # `end_update` would lay the whole text out again
+        document.set_style(0, len(document.text), changed)
+        continue
+      obj.begin_update()
+      document.set_style(0, len(document.text), changed)
+      obj.end_update()
 
 
 _default_font = Font({
@@ -126,6 +173,8 @@ _default_font = Font({
 })
 Style.subnames.append('font')
 Style.subnames.append('color')
+Style.converters['color'] = to_color
+Style.paint_properties.add('color')
 Style.defaults['font'] = Font
 styles['*'].set_by_subname('font', _default_font)
 styles['*'].set_by_subname('color', 'black')
\ No newline at end of file
@@ -1,53 +1,170 @@
+# built-in
+import weakref
+# css
 from ..utility import mutualmethod, mutualproperty
 from .style import styles, Style
 
 
+class _StyleCache(object):
+  """Cascaded styles, valid while `stamp` is unchanged."""
+  
+  def __init__(self):
+    self.stamp = None
+    self.styles = {}
+  
+  def get(self, stamp, key):
+    if stamp != self.stamp:
+      self.stamp = stamp
+      self.styles.clear()
+    return self.styles.get(key)
+
+# styles of nodes without own rules, keyed by class and state
+_shared_styles = _StyleCache()
+
+
+class _Version(object):
+  """Counter of changes of node's own rules. Rules only
+  refer to it (not to the node), so they die with the node."""
+  
+  def __init__(self):
+    self.value = 0
+  
+  def touch(self):
+    self.value += 1
+
+# nodes having own rules (see `CSSNode.style`)
+_nodes_with_rules = weakref.WeakSet()
+
+def count_rules():
+  """Returns number of live rules: those in `styles` and
+  own rules of all existing nodes."""
+  own_rules = sum(len(node._CSSNode__rules) for node in _nodes_with_rules)
+  return len(styles) + own_rules
+
+_class_names = {}
+
+def _get_class_names(cls):
+  """Returns names of `CSSNode` classes in `cls`'s MRO,
+  starting from the most basic one."""
+  names = _class_names.get(cls)
+  if names is None:
+    classes = [c for c in cls.mro() if issubclass(c, CSSNode)][::-1]
+    names = _class_names[cls] = tuple(c.__name__ for c in classes)
+  return names
+
+
 class CSSNode(object):
   
   def __init__(self, style = None):
     self.id = '%x' % id(self)
-    style = style or Style()
-    self.style.update(style)
+    # own rules, keyed by pseudo-class (None for the node itself)
+    self.__rules = {}
+    self.__rules_version = _Version()
+    if style:
+      self.style.update(style)
     self.__evaluated_style = None
+    self.__own_styles = _StyleCache()
     self.state = []
     self.positioning = lambda x, y: (x, y)
+    # what has to be re-evaluated (see `css.update`)
+    self.style_dirty = True
+    self.layout_dirty = True
   
   def __dirty(self):
-    self.__evaluated_style = None
+    self.invalidate()
+  
+  def invalidate(self):
+    """Marks node's style as outdated."""
+    self.style_dirty = True
+    self.request_update()
+  
+  def invalidate_layout(self):
+    """Marks node's layout as outdated (e. g. its content
+    size or children changed), while its style is still valid.
+    """
+    self.layout_dirty = True
+    self.request_update()
+  
+  def request_update(self):
+    """Called when something is marked as outdated. By default
+    node is re-evaluated right away; subclasses may postpone it.
+    """
     self.order()
   
   def add_state(self, state):
     if state not in self.state:
       self.state.append(state)
-      self.__dirty()
+      if self.__affects_style(state):
+        self.__dirty()
   
   def remove_state(self, state):
     if state in self.state:
       self.state.remove(state)
-      self.__dirty()
+      if self.__affects_style(state):
+        self.__dirty()
   
   def has_state(self, state):
     return state in self.state
   
+  def __affects_style(self, state):
+    """Checks if there are any rules for `state`
+    (pseudo-class) applicable to this node."""
+    if state in self.__rules:
+      return True
+    names = _get_class_names(type(self))
+    return state in styles.class_states(names)
+  
   def evaluate_style(self):
-    id_query = '#' + self.id
-    classes = type(self).mro()
-    class_queries = ['.' + cls.__name__ for cls in classes if issubclass(cls, CSSNode)][::-1]
+    # states without rules don't matter, so
+    # they are not a part of the cache key
+    states = frozenset(filter(self.__affects_style, self.state))
+    version = self.__rules_version.value if self.__rules else None
+    if version is None: # no own rules, can share the style
+      cache, key = _shared_styles, (type(self), states)
+    else:
+      cache, key = self.__own_styles, states
+    cascaded = cache.get((styles.generation, version), key)
+    if cascaded is None:
+      cascaded = cache.styles[key] = self.__cascade()
+    # cascaded style is shared, but evaluated one
+    # keeps node-specific data (see `apply_to`)
+    self.evaluated_style = cascaded.clone()
+  
+  def __cascade(self):
+    # only existing rules are looked up here, so
+    # no empty rules are created in `styles`
     style = Style()
     # common stylesheet
-    applicable_styles = ['*']
+    universal = styles.get('*')
+    if universal is not None:
+      style.update(universal)
+    # states are applied in a fixed order, not in the order they
+    # were added, since cached styles are keyed by the set of them
+    states = sorted(self.state)
     # class-specific stylesheets
-    for query in class_queries:
-      applicable_styles.append(query)
-      applicable_styles.extend(query + ':' + pseudo for pseudo in self.state)
+    class_rules = styles.class_rules(_get_class_names(type(self)))
+    for rule, pseudo_rules in class_rules:
+      if rule is not None:
+        style.update(rule)
+      for pseudo in states:
+        if pseudo in pseudo_rules:
+          style.update(pseudo_rules[pseudo])
     # object-specific stylesheets
-    applicable_styles.append(id_query)
-    applicable_styles.extend(id_query + ':' + pseudo for pseudo in self.state)
-    # now collecting all together
-    #from pprint import pprint; pprint(applicable_styles)
-    for applicable_style in applicable_styles:
-      style.update(styles[applicable_style])
-    self.evaluated_style = style
+    rules = self.__rules
+    if rules:
+      for pseudo in [None] + states:
+        if pseudo in rules:
+          style.update(rules[pseudo])
+    return style
+  
+  def __own_rule(self, pseudo):
+    rule = self.__rules.get(pseudo)
+    if rule is None:
+      rule = self.__rules[pseudo] = Style()
+      rule.watch(self.__rules_version.touch)
+      self.__rules_version.touch()
+      _nodes_with_rules.add(self)
+    return rule
   
   @property
   def evaluated_style(self):
@@ -56,7 +173,7 @@ class CSSNode(object):
     from logging import warn
     warn('Trying to access `CSSNode.evaluated_style` '
          'before it was actually evaluated')
-    return styles['#' + self.id]
+    return self.style
   
   @evaluated_style.setter
   def evaluated_style(self, style):
@@ -65,7 +182,7 @@ class CSSNode(object):
   @mutualproperty
   def style(self):
     if isinstance(self, CSSNode):
-      return styles['#' + self.id]
+      return self.__own_rule(None)
     elif isinstance(self, type):
       return styles['.' + self.__name__]
     else:
@@ -75,7 +192,7 @@ class CSSNode(object):
   @mutualmethod
   def pseudostyle(self, which):
     if isinstance(self, CSSNode):
-      return styles['#%s:%s' % (self.id, which)]
+      return self.__own_rule(which)
     elif isinstance(self, type):
       return styles['.%s:%s' % (self.__name__, which)]
     else:
@@ -115,6 +232,11 @@ class CSSNode(object):
       setattr(self, key, value)
     self.evaluated_style.apply_to(self)
   
+  def repaint(self):
+    """Applies evaluated style again when only its paint
+    properties changed (see `Style.paint_properties`)."""
+    self.evaluated_style.apply_to(self)
+  
   def set_position(self, x, y):
     position = (x, y)
     if hasattr(self, 'position'):
@@ -4,14 +4,21 @@ try:
 except ImportError:
   from logging import warn
   warn('Couldn\'t import PyOpenGL.')
+# built-in
+import itertools
+# pyglet
+import pyglet
+from pyglet.text import layout as text_layout
 # cocos2d
+from cocos import euclid
 from cocos.director import director
 # css
 import border, borderimage, background, style
+from .node import CSSNode
 from .utility import expand_sided_value, expand_hv_value
 from .color import Color
-import texturing
-from .texturing import rect_from_sides
+import texturing, atlas
+from .texturing import rect_from_sides, GeometryBuffer
 
 
 class BorderSide(border.BorderSide):
@@ -28,7 +35,7 @@ class BorderSide(border.BorderSide):
     if width <= 0 or \
        style in ('none', 'hidden') or \
        color.is_transparent():
-      self.__vertices = []
+      self.__vertices = GeometryBuffer()
       return
     if self.style not in ('solid', 'hidden', 'inset', 'outset'):
       raise NotImplementedError(
@@ -65,7 +72,12 @@ class BorderSide(border.BorderSide):
                          ('outset', 'left' ), ('outset', 'top'   )]:
       self.__color = color.lighten()
     self.__vertices_count = len(vertices)
-    self.__vertices = texturing.to_buffer(vertices)
+    self.__vertices = GeometryBuffer(vertices)
+  
+  def _Border__geometry(self):
+    if not self.__vertices:
+      return []
+    return [(None, self.__vertices, None, self.__color)]
   
   def _Border__draw(self):
     if not self.__vertices:
@@ -76,7 +88,7 @@ class BorderSide(border.BorderSide):
     
     GL.glColor4ubv(self.__color)
     GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
-    GL.glVertexPointer(2, GL.GL_FLOAT, 0, self.__vertices)
+    GL.glVertexPointer(2, GL.GL_FLOAT, 0, self.__vertices.pointer)
     GL.glDrawArrays(GL.GL_QUADS, 0, self.__vertices_count)
     
     GL.glPopClientAttrib()
@@ -223,25 +235,27 @@ class BorderImage(borderimage.BorderImage):
         )
       }
     
-    texture = image.get_texture()
-    self.__vertices  = []
-    self.__texcoords = []
-    
+    # texcoords are computed for this texture, so it's kept
+    # (even if atlases are enabled or disabled afterwards)
+    self.__texture = texture = atlas.get_texture(image)
+    self.__vertices  = GeometryBuffer()
+    self.__texcoords = GeometryBuffer()
     for kwargs in tiling_arguments.itervalues():
-      v, tc = texturing.tile(texture, action='evaluate', **kwargs)
-      self.__vertices.extend(v)
+      v, tc = texturing.tile(texture, action='arrays', **kwargs)
+      self.__vertices .extend(v )
       self.__texcoords.extend(tc)
-    
-    # now optimization
     self.__vertices_count = len(self.__vertices)
-    self.__vertices  = texturing.to_buffer(self.__vertices )
-    self.__texcoords = texturing.to_buffer(self.__texcoords)
+  
+  def _Border__geometry(self):
+    if self.source == 'none':
+      return []
+    return [(self.__texture, self.__vertices, self.__texcoords, None)]
   
   def _Border__draw(self):
     if self.source == 'none':
       return
     
-    texture = self.source.get_texture()
+    texture = self.__texture
     
     GL.glPushAttrib(GL.GL_ENABLE_BIT | GL.GL_TEXTURE_BIT)
     GL.glPushClientAttrib(GL.GL_CLIENT_ALL_ATTRIB_BITS)
@@ -250,14 +264,139 @@ class BorderImage(borderimage.BorderImage):
     GL.glBindTexture(texture.target, texture.id)
     GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
     GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
-    GL.glVertexPointer  (2, GL.GL_FLOAT, 0, self.__vertices )
-    GL.glTexCoordPointer(2, GL.GL_FLOAT, 0, self.__texcoords)
+    GL.glVertexPointer  (2, GL.GL_FLOAT, 0, self.__vertices .pointer)
+    GL.glTexCoordPointer(2, GL.GL_FLOAT, 0, self.__texcoords.pointer)
     GL.glDrawArrays(GL.GL_QUADS, 0, self.__vertices_count)
     
     GL.glPopClientAttrib()
     GL.glPopAttrib()
 
 
+class Background(background.Background):
+  def __init__(self, *args, **kwargs):
+    super(Background, self).__init__(*args, **kwargs)
+    self.__key = None
+    self.__quad = None
+    self.__tiles_count = 0
+  
+  def apply_to(self, node):
+    super(Background, self).apply_to(node)
+    self.__prepare()
+  
+  ## drawing functions ##
+  def __prepare(self):
+    node = self.node
+    # WARNING using background-origin here, but
+    # it won't work for `initial` and `inherit`
+    box = tuple(getattr(node, self.origin.replace('-', '_')))
+    key = (box,) + self.get_as_value()
+    if key == self.__key:
+      return # geometry is still valid
+    self.__key = key
+    
+    x, y, w, h = box
+    l, t, r, b = x, y, x + w, y + h
+    color = Color(self.color)
+    if color.is_transparent():
+      self.__quad = None
+    else:
+      self.__color = color
+      self.__quad = GeometryBuffer([(l, t), (l, b), (r, b), (r, t)])
+    
+    self.__tiles_count = 0
+    if self.image == 'none':
+      return
+    iw, ih = self.image.width, self.image.height
+    size = self.size
+    if size == 'auto':
+      tile_size = iw, ih
+    elif size == 'cover':
+      scale = max(w / float(iw), h / float(ih))
+      tile_size = int(iw * scale), int(ih * scale)
+    elif size == 'contain':
+      scale = min(w / float(iw), h / float(ih))
+      tile_size = int(iw * scale), int(ih * scale)
+    elif isinstance(size, (int, float, tuple)):
+      if isinstance(size, (int, float)):
+        mw = mh = size
+      else:
+        mw, mh = size
+      if isinstance(mw, int) and isinstance(mh, int):
+        pass
+      elif isinstance(mw, float) and isinstance(mh, float): # TODO percent class
+        mw = int(iw * (mw * 0.01))
+        mh = int(ih * (mh * 0.01))
+      else:
+        raise ValueError(
+          'Invalid value for background-size: %r' % size
+        )
+      tile_size = mw, mh
+    
+    repeat = self.repeat
+    if repeat == 'repeat':
+      bg_size = w, h
+    elif repeat == 'repeat-x':
+      bg_size = w, tile_size[1]
+    elif repeat == 'repeat-y':
+      bg_size = tile_size[0], h
+    elif repeat == 'no-repeat':
+      bg_size = tile_size
+    else:
+      raise ValueError(
+        'Invalid value for background-repeat: %r' % repeat
+      )
+    
+    # TODO: implement background-position, background-clip
+    # texcoords are computed for this texture, see `BorderImage`
+    self.__tiles_texture = texture = atlas.get_texture(self.image)
+    vertices, texcoords = texturing.tile(
+      texture, (l, t) + tuple(bg_size), tile_size, action='arrays')
+    self.__tiles_vertices  = GeometryBuffer(vertices )
+    self.__tiles_texcoords = GeometryBuffer(texcoords)
+    self.__tiles_count = len(self.__tiles_vertices)
+  
+  def geometry(self):
+    """Returns list of `(texture, vertices, texcoords, color)`
+    describing quads drawn by `draw`, in node's coordinates.
+    `texture` (and `texcoords`) are None for plain quads, and
+    `color` is None for textured ones.
+    """
+    result = []
+    if self.__quad is not None:
+      result.append((None, self.__quad, None, self.__color))
+    if self.__tiles_count:
+      result.append((self.__tiles_texture, self.__tiles_vertices,
+                     self.__tiles_texcoords, None))
+    return result
+  
+  def draw(self):
+    if self.__quad is None and not self.__tiles_count:
+      return
+    
+    GL.glPushClientAttrib(GL.GL_CLIENT_ALL_ATTRIB_BITS)
+    GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+    
+    if self.__quad is not None:
+      GL.glPushAttrib(GL.GL_CURRENT_BIT)
+      GL.glColor4ubv(self.__color)
+      GL.glVertexPointer(2, GL.GL_FLOAT, 0, self.__quad.pointer)
+      GL.glDrawArrays(GL.GL_QUADS, 0, 4)
+      GL.glPopAttrib()
+    
+    if self.__tiles_count:
+      texture = self.__tiles_texture
+      GL.glPushAttrib(GL.GL_ENABLE_BIT | GL.GL_TEXTURE_BIT)
+      GL.glEnable(texture.target)
+      GL.glBindTexture(texture.target, texture.id)
+      GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+      GL.glVertexPointer  (2, GL.GL_FLOAT, 0, self.__tiles_vertices .pointer)
+      GL.glTexCoordPointer(2, GL.GL_FLOAT, 0, self.__tiles_texcoords.pointer)
+      GL.glDrawArrays(GL.GL_QUADS, 0, self.__tiles_count)
+      GL.glPopAttrib()
+    
+    GL.glPopClientAttrib()
+
+
 class Border(border.Border):
   defaults = dict(border.Border.defaults, **{
     'left'  : lambda: BorderSide('left'  ),
@@ -267,6 +406,15 @@ class Border(border.Border):
     'image' : BorderImage,
   })
   
+  def geometry(self):
+    """Returns what `draw` draws, see `Background.geometry`."""
+    if self.image.source != 'none':
+      return self.image.__geometry()
+    result = []
+    for side in (self.left, self.top, self.right, self.bottom):
+      result.extend(side.__geometry())
+    return result
+  
   def draw(self):
     if self.image.source != 'none':
       self.image.__draw()
@@ -275,8 +423,365 @@ class Border(border.Border):
         side.__draw()
 
 
+_white = Color('white')
+
+def _transform_to(node, ancestor):
+  """Returns matrix transforming `node`'s coordinates
+  to `ancestor`'s ones."""
+  matrix = euclid.Matrix3.new_identity()
+  while node is not ancestor:
+    matrix = node.get_local_transform() * matrix
+    node = node.parent
+  return matrix
+
+def _top_node(node, layer):
+  """Returns `node`'s ancestor (or itself) being a child of `layer`."""
+  while node.parent is not layer:
+    node = node.parent
+  return node
+
+def _batchable(top):
+  """Returns True if the subtree of top-level node `top`
+  can be drawn by `BatchRenderer`."""
+  if not isinstance(top, CSSNode):
+    return False # e. g. a sprite holding nodes
+  nodes = [top]
+  while nodes:
+    node = nodes.pop()
+    if node.draws_custom_content() or node.texture_cache is not None:
+      return False
+    nodes.extend(child for child in node.get_children()
+                 if isinstance(child, CSSNode))
+  return True
+
+def _drawn_nodes(node, drawn=False):
+  """Yields evaluated `CSSNode`s of `node`'s subtree (`node`
+  itself too, if `drawn`) in the order they are drawn by
+  `CocosNode.visit`."""
+  for z, child in node.children:
+    if drawn and z >= 0:
+      yield node # children with negative z go before
+      drawn = False
+    if child.visible:
+      child_drawn = isinstance(child, CSSNode) and \
+                    hasattr(child, 'border_box')
+      for descendant in _drawn_nodes(child, child_drawn):
+        yield descendant
+  if drawn:
+    yield node
+
+
+class BatchRenderer(object):
+  """Draws backgrounds and borders of nodes of a layer at once
+  for each top-level node (when it is visited, see `draw`).
+  Their geometry is kept in shared buffers (in layer's
+  coordinates) and drawn with one call per run of quads having
+  the same texture, in the usual drawing order.
+  
+  Geometry of a node is rebuilt only after `invalidate(node)`;
+  if the number of its vertices stays the same, just its range
+  of the buffers is updated. `invalidate_order` makes the whole
+  buffers to be reassembled (e. g. when nodes are added).
+  
+  Texts of nodes (`GUINode.text_objects`) are drawn by `TextBatch`
+  right after backgrounds and borders of their top-level node
+  (e. g. a window), so overlapping windows cover each other's texts.
+  
+  Subtrees of top-level nodes drawing anything else (see
+  `GUINode.draws_custom_content`) or cached in textures
+  are drawn by their nodes as usual.
+  """
+  
+  def __init__(self, layer):
+    self.layer = layer
+    self.texts = TextBatch(layer)
+    self.vertices  = GeometryBuffer()
+    self.texcoords = GeometryBuffer()
+    self.colors    = GeometryBuffer(components=4, typecode='B')
+    self.__nodes = None   # in drawing order, None if outdated
+    self.__geometry = {}  # node -> list of (texture, vertices, texcoords, colors)
+    self.__ranges = {}    # node -> index of node's first vertex
+    # top-level node -> runs of its subtree: [texture, first vertex, vertices count]
+    self.__parts = {}
+    self.__outdated = set()
+  
+  def invalidate(self, node):
+    """Marks geometry of `node` as outdated."""
+    self.__outdated.add(node)
+  
+  def invalidate_order(self):
+    """Marks set or order of drawn nodes as outdated."""
+    self.__nodes = None
+  
+  def draws(self, node):
+    """Returns True if `node` is drawn by the renderer (as of
+    the last `update`)."""
+    return node in self.__geometry
+  
+  def text_origin(self, node):
+    """Returns origin of `node`'s content box in layer's
+    coordinates if its texts are drawn by the renderer,
+    None otherwise (see `TextBatch.can_draw`)."""
+    if node not in self.texts:
+      return None
+    matrix = _transform_to(node, self.layer)
+    return tuple(matrix * euclid.Point2(*node.content_box[:2]))
+  
+  def update(self):
+    outdated, self.__outdated = self.__outdated, set()
+    for node in outdated:
+      if node.text_objects and \
+         self.texts.can_draw(node) != (node in self.texts):
+        self.__nodes = None # e. g. it is rotated now
+      elif node in self.__geometry and node.texture_cache is not None:
+        self.__nodes = None # its subtree can't be batched now
+      elif node in self.texts:
+        node.place_texts()
+    geometry = self.__geometry
+    if self.__nodes is None:
+      batched = {} # top-level node -> whether its subtree is batched
+      self.__nodes = []
+      for node in _drawn_nodes(self.layer):
+        top = _top_node(node, self.layer)
+        if top not in batched:
+          batched[top] = _batchable(top)
+        if batched[top]:
+          self.__nodes.append(node)
+      self.texts.update(self.__nodes)
+      old_geometry, self.__geometry = geometry, {}
+      for node in self.__nodes:
+        if node in outdated or node not in old_geometry:
+          self.__geometry[node] = self.__node_geometry(node)
+        else:
+          self.__geometry[node] = old_geometry[node]
+      self.__rebuild()
+      return
+    patches = []
+    reshaped = False
+    for node in outdated:
+      if node not in geometry:
+        continue # not drawn
+      old, new = geometry[node], self.__node_geometry(node)
+      geometry[node] = new
+      if _shape(old) != _shape(new):
+        reshaped = True # the rest is still to be updated
+      patches.append(node)
+    if reshaped:
+      self.__rebuild()
+      return
+    for node in patches:
+      index = self.__ranges[node]
+      for texture, vertices, texcoords, colors in geometry[node]:
+        self.vertices .update(index, vertices )
+        self.texcoords.update(index, texcoords)
+        self.colors   .update(index, colors   )
+        index += len(vertices)
+  
+  def __node_geometry(self, node):
+    matrix = _transform_to(node, self.layer)
+    a, b, c = matrix.a, matrix.b, matrix.c
+    e, f, g = matrix.e, matrix.f, matrix.g
+    style = node.evaluated_style
+    result = []
+    for texture, vertices, texcoords, color in \
+        style.background.geometry() + style.border.geometry():
+      data = vertices.data
+      xs, ys = data[0::2], data[1::2]
+      vertices = [(a * x + b * y + c, e * x + f * y + g)
+                  for x, y in itertools.izip(xs, ys)]
+      if texcoords is None:
+        texcoords = [(0., 0.)] * len(vertices)
+      else:
+        data = texcoords.data
+        texcoords = zip(data[0::2], data[1::2])
+      colors = [color or _white] * len(vertices)
+      result.append((texture, vertices, texcoords, colors))
+    return result
+  
+  def __rebuild(self):
+    for buffer in (self.vertices, self.texcoords, self.colors):
+      buffer.clear()
+    self.__ranges = {}
+    self.__parts = parts = {}
+    for node in self.__nodes:
+      runs = parts.setdefault(_top_node(node, self.layer), [])
+      self.__ranges[node] = len(self.vertices)
+      for texture, vertices, texcoords, colors in self.__geometry[node]:
+        key = _texture_key(texture)
+        if runs and _texture_key(runs[-1][0]) == key:
+          runs[-1][2] += len(vertices)
+        else:
+          runs.append([texture, len(self.vertices), len(vertices)])
+        self.vertices .extend(vertices )
+        self.texcoords.extend(texcoords)
+        self.colors   .extend(colors   )
+  
+  def draw(self, top):
+    """Draws the subtree of top-level node `top` (in
+    layer's coordinates), called by the node itself."""
+    runs = self.__parts.get(top)
+    if runs:
+      self.__draw_runs(runs)
+    batch = self.texts.batches.get(top)
+    if batch is not None:
+      batch.draw()
+  
+  def __draw_runs(self, runs):
+    GL.glPushAttrib(GL.GL_ENABLE_BIT | GL.GL_TEXTURE_BIT)
+    GL.glPushClientAttrib(GL.GL_CLIENT_ALL_ATTRIB_BITS)
+    
+    GL.glEnableClientState(GL.GL_VERTEX_ARRAY)
+    GL.glEnableClientState(GL.GL_TEXTURE_COORD_ARRAY)
+    GL.glEnableClientState(GL.GL_COLOR_ARRAY)
+    GL.glVertexPointer  (2, GL.GL_FLOAT, 0, self.vertices .pointer)
+    GL.glTexCoordPointer(2, GL.GL_FLOAT, 0, self.texcoords.pointer)
+    GL.glColorPointer(4, GL.GL_UNSIGNED_BYTE, 0, self.colors.pointer)
+    target = None # currently enabled
+    for texture, first, count in runs:
+      if texture is None:
+        if target is not None:
+          GL.glDisable(target)
+          target = None
+      else:
+        if target != texture.target:
+          if target is not None:
+            GL.glDisable(target)
+          target = texture.target
+          GL.glEnable(target)
+        GL.glBindTexture(texture.target, texture.id)
+      GL.glDrawArrays(GL.GL_QUADS, first, count)
+    
+    GL.glPopClientAttrib()
+    GL.glPopAttrib()
+
+class TextBatch(object):
+  """Draws texts (pyglet's text layouts, `text_objects`) of
+  all nodes of a layer with a `pyglet.graphics.Batch` per
+  top-level node (see `BatchRenderer.draw`).
+  
+  Texts of the same top-level node share rendering groups, so
+  they are drawn with one call per glyph texture (pyglet keeps
+  glyphs of a font in shared textures). Texts clipped by their
+  node (see `GUINode.text_clip_rect`) get groups of their own.
+  """
+  
+  def __init__(self, layer):
+    self.layer = layer
+    self.batches = {} # top-level node -> batch of its texts
+    self.__groups = {} # node -> groups its texts use
+    # top-level node or (node, top-level node) of a clipped
+    # node -> groups, see `_text_groups`
+    self.__cache = {}
+    self.__origins = {} # text -> its own batch and groups
+  
+  def __contains__(self, node):
+    return node in self.__groups
+  
+  def can_draw(self, node):
+    """Returns True if texts of `node` can be drawn by the
+    batch: pyglet lays them out in layer's coordinates along
+    its axes, so `node` may be only translated relative to
+    the layer (not scaled or rotated)."""
+    matrix = _transform_to(node, self.layer)
+    return (matrix.a, matrix.b, matrix.e, matrix.f) == (1, 0, 0, 1)
+  
+  def update(self, nodes):
+    """Makes the batches draw texts of `nodes` (those that
+    `can_draw`), given in drawing order, and only them."""
+    old_groups, self.__groups = self.__groups, {}
+    old_cache, self.__cache = self.__cache, {}
+    old_batches, self.batches = self.batches, {}
+    for node in nodes:
+      if not node.text_objects or not self.can_draw(node):
+        continue
+      top = _top_node(node, self.layer)
+      batch = self.batches.get(top) or old_batches.get(top)
+      if batch is None:
+        batch = pyglet.graphics.Batch()
+      self.batches[top] = batch
+      clipped = node.text_clip_rect is not None
+      key = (node, top) if clipped else top
+      groups = self.__cache.get(key) or old_cache.get(key)
+      if groups is None:
+        groups = _text_groups(_ClipGroup(node) if clipped else None)
+      self.__cache[key] = self.__groups[node] = groups
+      if old_groups.get(node) is not groups:
+        for text in node.text_objects:
+          if text not in self.__origins:
+            self.__origins[text] = (text.batch, [getattr(text, name)
+                                                 for name in _group_names])
+          _move_text(text, batch, groups)
+        node.place_texts() # to layer's coordinates
+    for node in set(old_groups) - set(self.__groups):
+      for text in node.text_objects:
+        if text in self.__origins:
+          _move_text(text, *self.__origins.pop(text))
+      if hasattr(node, 'content_box'):
+        node.place_texts() # back to node's coordinates
+
+
+class _ClipGroup(pyglet.graphics.Group):
+  """Clips its children to `node.text_clip_rect`."""
+  
+  def __init__(self, node, parent=None):
+    super(_ClipGroup, self).__init__(parent)
+    self.node = node
+  
+  def set_state(self):
+    GL.glPushAttrib(GL.GL_SCISSOR_BIT)
+    GL.glEnable(GL.GL_SCISSOR_TEST)
+    GL.glScissor(*map(int, self.node.text_clip_rect))
+  
+  def unset_state(self):
+    GL.glPopAttrib()
+
+# groups pyglet's text layouts draw with, see `_move_text`
+_group_names = ('top_group', 'background_group',
+                'foreground_group', 'foreground_decoration_group')
+
+def _text_groups(parent):
+  """Returns groups for text layouts, same as ones
+  `TextLayout._init_groups(parent)` creates."""
+  top = text_layout.TextLayoutGroup(parent)
+  return (top,
+          pyglet.graphics.OrderedGroup(0, top),
+          text_layout.TextLayoutForegroundGroup(1, top),
+          text_layout.TextLayoutForegroundDecorationGroup(2, top))
+
+def _move_text(text, batch, groups):
+  """Moves pyglet's text layout `text` to `batch`, making it
+  use `groups` (see `_text_groups`); layouts using the same
+  groups are drawn together.
+  
+  NOTE pyglet < 1.4 has no public way of changing layout's
+  batch, so its private attributes are set then.
+  """
+  for name, group in zip(_group_names, groups):
+    setattr(text, name, group)
+  batch_setter = getattr(getattr(type(text), 'batch', None), 'fset', None)
+  if batch_setter is not None and text.batch is not batch:
+    text.batch = batch # lays the text out in the new batch itself
+    return
+  text.batch, text._own_batch = batch, False
+  text._update() # vertex lists are recreated with the new groups
+
+def _texture_key(texture):
+  if texture is None:
+    return None
+  # regions of the same texture can be drawn together
+  return (texture.target, texture.id)
+
+def _shape(geometry):
+  return [(_texture_key(texture), len(vertices))
+          for texture, vertices, texcoords, colors in geometry]
+
+
 style.Style.defaults['border'] = Border
 _default_border = style.styles['*'].get_by_subname('border')
 _default_image = _default_border.get_by_subname('image')
 _default_border.set_by_subname('image', BorderImage(_default_image))
 style.styles['*'].set_by_subname('border', Border(_default_border))
+
+style.Style.defaults['background'] = Background
+_default_background = style.styles['*'].get_by_subname('background')
+style.styles['*'].set_by_subname('background', Background(_default_background))
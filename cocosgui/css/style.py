@@ -1,4 +1,3 @@
-from collections import defaultdict
 from utility import to_words, from_words
 from utility import expand_sided_value, collapse_sided_value
 
@@ -14,10 +13,18 @@ class StylesContainer(dict):
   # default values for properties
   defaults = {}
   
+  # functions normalizing written values, e. g.
+  # parsing colors once instead of on every use
+  converters = {}
+  
   def __init__(self, something = None, **kwargs):
     self.node = None
+    self.watcher = None
     if isinstance(something, dict):
       super(StylesContainer, self).__init__(something, **kwargs)
+      for subname, convert in self.converters.iteritems():
+        if subname in self:
+          dict.__setitem__(self, subname, convert(dict.get(self, subname)))
     else:
       super(StylesContainer, self).__init__(**kwargs)
       if something is not None:
@@ -29,6 +36,15 @@ class StylesContainer(dict):
       if isinstance(subitem, StylesContainer):
         subitem.apply_to(node)
   
+  def inherit(self, node):
+    """Resolves values depending on `node`'s parent. Nodes
+    are processed top-down, so parent's values are resolved
+    already by the time.
+    """
+    for subitem in self.values():
+      if isinstance(subitem, StylesContainer):
+        subitem.inherit(node)
+  
   def __str__(self):
     try:
       as_value = self.get_as_value()
@@ -60,7 +76,28 @@ class StylesContainer(dict):
     raise NotImplementedError # abstract
   
   def on_change(self):
-    pass
+    if self.watcher is not None:
+      self.watcher()
+  
+  def watch(self, watcher):
+    """Makes `watcher` to be called on any change
+    of this object or its subobjects."""
+    self.watcher = watcher
+    for subitem in self.values():
+      if isinstance(subitem, StylesContainer):
+        subitem.watch(watcher)
+  
+  def clone(self):
+    """Returns a deep copy of this object (subobjects are
+    copied too, plain values are shared)."""
+    result = dict.__new__(type(self))
+    result.__dict__.update(self.__dict__)
+    result.watcher = None
+    for key, value in self.iteritems():
+      if isinstance(value, StylesContainer):
+        value = value.clone()
+      dict.__setitem__(result, key, value)
+    return result
   
   def create_default(self, subname):
     default = self.defaults.get(subname)
@@ -72,6 +109,9 @@ class StylesContainer(dict):
       return None
   
   def get_by_subname(self, subname):
+    subobject = dict.get(self, subname)
+    if subobject is not None:
+      return subobject # fast path
     if subname not in self.subnames:
       raise KeyError(
         '%r not in %s' % (subname, self.prefix or 'style'))
@@ -84,9 +124,22 @@ class StylesContainer(dict):
     if subname not in self.subnames:
       raise KeyError(
         '%r not in %s' % (subname, self.prefix or 'style'))
+    convert = self.converters.get(subname)
+    if convert is not None:
+      value = convert(value)
     super(StylesContainer, self).__setitem__(subname, value)
+    if self.watcher is not None:
+      if isinstance(value, StylesContainer):
+        value.watch(self.watcher)
+      self.watcher()
   
   def __getitem__(self, which):
+    if isinstance(which, basestring):
+      return compile_property(which).get(self)
+    return self.get_by_words(which)
+  
+  def get_by_words(self, which):
+    """Slow (but complete) version of `__getitem__`."""
     words = to_words(which)
     if self.prefix is None:
       words = [None] + words
@@ -119,10 +172,29 @@ class StylesContainer(dict):
     self.on_change()
   
   def __getattr__(self, which):
-    try:
-      return super(StylesContainer, self).__getattr__(self, which)
-    except AttributeError:
-      return self.get_by_subname(which)
+    # called only when there is no such attribute, so
+    # there is no need to look for it in the usual way
+    return self.get_by_subname(which)
+  
+  def changed_properties(self, other):
+    """Returns full names of properties whose values
+    differ in `self` and `other`.
+    
+    >>> Style(color='red').changed_properties(Style(color='blue'))
+    ['color']
+    """
+    result = []
+    for subname in set(self) | set(other):
+      mine, theirs = dict.get(self, subname), dict.get(other, subname)
+      if mine is theirs:
+        continue
+      if isinstance(mine, StylesContainer) and \
+         isinstance(theirs, StylesContainer):
+        for name in mine.changed_properties(theirs):
+          result.append(from_words([subname, name]))
+      elif mine != theirs:
+        result.append(subname)
+    return result
   
   def update(self, other={}, **kwargs):
     other = dict(other)
@@ -143,6 +215,54 @@ class StylesContainer(dict):
       else:
         self.__setitem__(key, value)
 
+
+class Property(object):
+  """Precompiled accessor of a property by its full name.
+  
+  >>> border_left_width = compile_property('border-left-width')
+  >>> border_left_width.get(style) == style['border-left-width']
+  True
+  """
+  
+  def __init__(self, name):
+    self.name = name
+    self.words = tuple(to_words(name))
+  
+  def get(self, container):
+    words = self.words
+    if container.prefix is not None:
+      if words[0] != container.prefix:
+        return container.get_by_words(words)
+      words = words[1:]
+    # fast path: just walking through existing subobjects
+    value = container
+    for subname in words:
+      if not isinstance(value, dict):
+        break
+      value = dict.get(value, subname)
+      if value is None:
+        break
+    else:
+      if not isinstance(value, StylesContainer):
+        return value
+    # defaults have to be created or a compound value
+    # (like `border-width`) has to be evaluated
+    return container.get_by_words(self.words)
+  
+  __call__ = get
+
+
+_properties = {}
+
+def compile_property(name):
+  """Returns `Property` for `name` (the same object
+  for the same name)."""
+  prop = _properties.get(name)
+  if prop is None:
+    prop = _properties[name] = Property(name)
+  return prop
+
+
 class SidedStylesContainer(StylesContainer):
   subnames = ['top', 'right', 'bottom', 'left']
   # WARNING: order is important here. this order
@@ -175,12 +295,18 @@ class Style(StylesContainer):
     'margin' : Margin,
     'padding': Padding,
   }
+  converters = {}
   subnames = [
     'display', 'position',
     'left', 'top', 'width', 'height',
     'margin', 'padding',
+    'cache', # 'none' or 'texture', see `caching.TextureCache`
   ]
   
+  # full names of properties which don't affect boxes,
+  # so changing them needs just repainting
+  paint_properties = set()
+  
   def get_as_value(self):
     return self
   
@@ -188,7 +314,96 @@ class Style(StylesContainer):
     self.update(value)
 
 
-styles = defaultdict(Style)
+class StyleSheet(dict):
+  """Mapping from selectors to `Style`s.
+  
+  Like `defaultdict(Style)`, creates empty rules for missing
+  selectors, which is handy for writing styles. Code reading
+  styles should use `get` and `class_rules` which never
+  create anything.
+  
+  Keeps track of changes: `generation` is increased on
+  every change of any rule. Rules of particular nodes are
+  not kept here, see `CSSNode.style`.
+  """
+  
+  def __init__(self):
+    super(StyleSheet, self).__init__()
+    self.generation = 0
+    self.__by_class = {} # class name -> [rule, {pseudo: rule}]
+    self.__compiled = {} # tuple of class names -> list of the above
+    self.__states = {} # tuple of class names -> pseudo-classes
+  
+  def __missing__(self, selector):
+    style = Style()
+    self.__register(selector, style)
+    return style
+  
+  def __setitem__(self, selector, style):
+    self.__register(selector, style)
+    self.touch()
+  
+  def __delitem__(self, selector):
+    super(StyleSheet, self).__delitem__(selector)
+    if selector.startswith('.'):
+      name, _, pseudo = selector[1:].partition(':')
+      rule, pseudo_rules = self.__by_class[name]
+      if pseudo:
+        del pseudo_rules[pseudo]
+      else:
+        self.__by_class[name][0] = None
+      if self.__by_class[name] == [None, {}]:
+        del self.__by_class[name]
+      self.__compiled.clear()
+      self.__states.clear()
+    self.touch()
+  
+  def __register(self, selector, style):
+    super(StyleSheet, self).__setitem__(selector, style)
+    style.watch(self.touch)
+    if selector.startswith('.'):
+      name, _, pseudo = selector[1:].partition(':')
+      entry = self.__by_class.setdefault(name, [None, {}])
+      if pseudo:
+        entry[1][pseudo] = style
+      else:
+        entry[0] = style
+      self.__compiled.clear()
+      self.__states.clear()
+  
+  def touch(self):
+    """Marks rules as changed."""
+    self.generation += 1
+  
+  def class_rules(self, names):
+    """Returns list of `(rule, pseudo_rules)` pairs for classes
+    named `names` (in that order), where `rule` is the rule
+    for `.Name` (or None) and `pseudo_rules` maps pseudo-classes
+    to rules for `.Name:pseudo`. Classes without any rules
+    are skipped.
+    """
+    rules = self.__compiled.get(names)
+    if rules is None:
+      by_class = self.__by_class
+      rules = [by_class[name] for name in names if name in by_class]
+      self.__compiled[names] = rules
+    return rules
+  
+  def class_states(self, names):
+    """Returns set of pseudo-classes having rules for any of
+    classes named `names`. Other states of nodes of these
+    classes can't change their styles.
+    """
+    states = self.__states.get(names)
+    if states is None:
+      states = frozenset(pseudo
+        for rule, pseudo_rules in self.class_rules(names)
+        for pseudo in pseudo_rules)
+      self.__states[names] = states
+    return states
+
+
+styles = StyleSheet()
 
 styles['*'] = Style({
     'width': 'auto',
@@ -199,4 +414,6 @@ styles['*'] = Style({
     'position': 'static',
     'left': 'auto',
     'top': 'auto',
+    'cache': 'none',
 })
+Style.paint_properties.add('cache')
@@ -1,4 +1,4 @@
-import operator
+import operator, itertools, array, ctypes
 if not hasattr(operator, 'div'):
   # Python3 compatibility
   def _div(a, b):
@@ -14,6 +14,10 @@ try:
 except ImportError:
   from logging import warn
   warn('Couldn\'t import PyOpenGL.')
+try:
+  import numpy
+except ImportError:
+  numpy = None # optional, pure Python code is used then
 
 
 def rect_from_sides(left, top, right, bottom):
@@ -66,12 +70,25 @@ _default_texcoords = [
 
 def tile(texture, rect, tile_size=None,
          texcoords=_default_texcoords, action='draw'):
-  if action not in ('evaluate', 'draw'):
+  """Tiles `rect` with `texture` (or its part given by
+  `texcoords`), scaled to `tile_size`.
+  
+  `action` is one of
+    'draw'     - draw tiles right away;
+    'evaluate' - return lists of vertices and texcoords;
+    'arrays'   - same, but as float32 NumPy arrays of shape
+                 (n, 2) if NumPy is available (which is much
+                 faster for many tiles); see `GeometryBuffer`.
+  """
+  if action not in ('evaluate', 'arrays', 'draw'):
     raise ValueError('Invalid action for `tile`: %r' % action)
   if tile_size is None:
     tile_size = texture.width, texture.height
   tilew, tileh = tile_size
   if tilew <= 0 or tileh <= 0:
+    if action == 'arrays' and numpy is not None:
+      empty = numpy.empty((0, 2), dtype=numpy.float32)
+      return empty, empty
     return (), ()
   
   l, t, bgw, bgh = rect
@@ -100,6 +117,9 @@ def tile(texture, rect, tile_size=None,
   assert(abs(ubasis[0] + ubasis[1] + ubasis[2] - tbr) < 1E-6)
   # (in other case our computations would be way too difficult.)
   
+  if action == 'arrays' and numpy is not None:
+    return _tile_arrays((l, t, bgw, bgh), tile_size, ubasis)
+  
   vertices = []
   texcoords = []
   
@@ -127,7 +147,7 @@ def tile(texture, rect, tile_size=None,
         drawnh += currtileh
       drawnw += currtilew
   
-  if action == 'evaluate':
+  if action in ('evaluate', 'arrays'):
     # typecasting them back
     return map(tuple, vertices), map(tuple, texcoords)
   
@@ -141,11 +161,116 @@ def tile(texture, rect, tile_size=None,
   GL.glEnd()
   GL.glPopAttrib()
 
+def _tile_spans(total, size):
+  """Returns offsets and sizes of tiles of `size` covering
+  `total`, the last one being clipped (like in `tile`)."""
+  count = int(total // size) + 1
+  # summing sequentially, just like `tile` does
+  ends = numpy.cumsum(numpy.repeat(numpy.float64(size), count))
+  offsets = numpy.concatenate(([0.], ends[:-1]))
+  offsets = offsets[offsets < total]
+  return offsets, numpy.minimum(size, total - offsets)
+
+def _tile_arrays(rect, tile_size, ubasis):
+  """Vectorized version of `tile`'s loop."""
+  l, t, bgw, bgh = rect
+  tilew, tileh = tile_size
+  xs, ws = _tile_spans(bgw, tilew)
+  ys, hs = _tile_spans(bgh, tileh)
+  # columns go first, rows inside them
+  L = numpy.repeat(l + xs, len(ys))
+  W = numpy.repeat(ws, len(ys))
+  T = numpy.tile(t + ys, len(xs))
+  H = numpy.tile(hs, len(xs))
+  U = W / float(tilew)
+  V = H / float(tileh)
+  vertices = numpy.empty((len(L), 4, 2))
+  vertices[:, 0, 0] = L;     vertices[:, 0, 1] = T + H # bottom left
+  vertices[:, 1, 0] = L + W; vertices[:, 1, 1] = T + H # bottom right
+  vertices[:, 2, 0] = L + W; vertices[:, 2, 1] = T     # top right
+  vertices[:, 3, 0] = L;     vertices[:, 3, 1] = T     # top left
+  origin, du, dv = [numpy.array(v, dtype=numpy.float64) for v in ubasis]
+  zero = numpy.zeros_like(U)
+  texcoords = numpy.empty((len(L), 4, 2))
+  for i, (u, v) in enumerate([(zero, V), (U, V), (U, zero)]):
+    texcoords[:, i] = (origin + u[:, None] * du) + v[:, None] * dv
+  texcoords[:, 3] = origin
+  return (vertices .reshape(-1, 2).astype(numpy.float32),
+          texcoords.reshape(-1, 2).astype(numpy.float32))
+
+class GeometryBuffer(object):
+  """Growable buffer of vertex data for `gl*Pointer` functions.
+  Each vertex consists of `components` values of `typecode`
+  ('f' for GL_FLOAT, 'B' for GL_UNSIGNED_BYTE).
+  
+  >>> vertices = GeometryBuffer()
+  >>> vertices.extend([(0, 0), (10, 0), (10, 10), (0, 10)])
+  >>> GL.glVertexPointer(2, GL.GL_FLOAT, 0, vertices.pointer)
+  >>> GL.glDrawArrays(GL.GL_QUADS, 0, len(vertices))
+  """
+  
+  def __init__(self, vertices=(), components=2, typecode='f'):
+    self.components = components
+    self.data = array.array(typecode)
+    self.__pointer = None
+    self.extend(vertices)
+  
+  def __len__(self):
+    """Returns number of vertices."""
+    return len(self.data) // self.components
+  
+  def append(self, vertex):
+    self.data.extend(vertex)
+    self.__pointer = None
+  
+  def extend(self, vertices):
+    """Appends `vertices`: either iterable of tuples or
+    NumPy array (see `tile(..., action='arrays')`)."""
+    if numpy is not None and isinstance(vertices, numpy.ndarray):
+      flat = numpy.ascontiguousarray(vertices, dtype=self.data.typecode)
+      self.data.fromstring(flat.tostring())
+    else:
+      self.data.extend(itertools.chain.from_iterable(vertices))
+    self.__pointer = None
+  
+  def update(self, index, vertices):
+    """Replaces vertices starting from `index` in place."""
+    n = self.components
+    typecode = self.data.typecode
+    if numpy is not None and isinstance(vertices, numpy.ndarray):
+      flat = array.array(typecode)
+      flat.fromstring(
+        numpy.ascontiguousarray(vertices, dtype=typecode).tostring())
+    else:
+      flat = array.array(typecode, itertools.chain.from_iterable(vertices))
+    if index * n + len(flat) > len(self.data):
+      raise IndexError('Updating vertices past the end of the buffer')
+    self.data[index * n:index * n + len(flat)] = flat
+  
+  def clear(self):
+    del self.data[:]
+    self.__pointer = None
+  
+  @property
+  def pointer(self):
+    """ctypes array sharing memory with the buffer (nothing is
+    copied). Becomes invalid when the buffer grows, so don't
+    keep it for long."""
+    if self.__pointer is None:
+      size = len(self.data)
+      if not size:
+        return None
+      ctype = _ctypes[self.data.typecode]
+      self.__pointer = (ctype * size).from_buffer(self.data)
+    return self.__pointer
+
+_ctypes = {'f': ctypes.c_float, 'B': ctypes.c_ubyte}
+
 def to_buffer(iterable, typecode=None):
-  if typecode is None:
-    typecode = GL.GL_FLOAT
-  array = sum(map(tuple, iterable), ())
-  return _list_handler.asArray(array, typecode)
+  if typecode is None or typecode == GL.GL_FLOAT:
+    return GeometryBuffer(iterable).pointer
+  values = list(itertools.chain.from_iterable(iterable))
+  return _list_handler.asArray(values, typecode)
   
 
 
@@ -7,6 +7,7 @@ import pyglet
 from pyglet.window import key
 # gui
 from .node import GUINode
+from .spatial import intersection
 # css
 from css.color import Color
 
@@ -31,10 +32,10 @@ class Caret(GUINode):
     selection = self.parent.selection
     if selection[0] != selection[1]:
       return
-    GL.glPushMatrix()
-    self.transform()
     self.glyph.draw()
-    GL.glPopMatrix()
+  
+  def draws_custom_content(self):
+    return True
   
   def apply_style(self, **options):
     super(Caret, self).apply_style(**options)
@@ -104,6 +105,7 @@ class TextEdit(GUINode):
       self.caret.x = self.content_box[0] # TODO hide at all
     self.caret.x -= self.caret.glyph.advance // 3 + 1
     self.caret.y = self.content_box[1]
+    self.invalidate_geometry()
   
   def get_caret_pos(self, x):
     for i, offset in enumerate(self.offsets):
@@ -113,23 +115,39 @@ class TextEdit(GUINode):
   
   def apply_style(self, **options):
     super(TextEdit, self).apply_style(**options)
-    tl = self.text_label
-    tl.x, tl.y, tl.width, tl.height = self.content_box
+    self.place_texts()
     self.update_caret()
   
+  @property
+  def text_clip_rect(self):
+    left, bottom = map(int, self.point_to_world(self.padding_box[:2]))
+    rect = (left, bottom) + tuple(self.padding_box[2:])
+    window = self.window
+    if window is not None and window.clip_rect is not None:
+      # e. g. the layer is redrawn partially, so not
+      # drawing outside of the current clip rectangle
+      rect = intersection(rect, window.clip_rect) or (0, 0, 0, 0)
+    return rect
+  
   def draw(self, *args, **kwargs):
     super(TextEdit, self).draw(*args, **kwargs)
-    GL.glPushMatrix()
+    if self.texts_batched:
+      return # text is drawn by the layer
     GL.glPushAttrib(GL.GL_SCISSOR_BIT)
-    self.transform()
     GL.glEnable(GL.GL_SCISSOR_TEST) # TODO move this to style['overflow'] = 'hidden'
-    left, bottom = map(int, self.point_to_world(self.padding_box[:2]))
-    GL.glScissor(left, bottom, *self.padding_box[2:])
+    GL.glScissor(*map(int, self.text_clip_rect))
     self.text_label.draw()
     GL.glPopAttrib()
-    GL.glPopMatrix()
   
   ## event handlers ##
+  def focus(self):
+    super(TextEdit, self).focus()
+    self.invalidate_geometry() # caret is shown only when focused
+  
+  def blur(self):
+    super(TextEdit, self).blur()
+    self.invalidate_geometry()
+  
   def key_press(self, button, modifiers):
     if button == key.BACKSPACE:
       # TODO Ctrl+Backspace erases a word
@@ -1,24 +1,210 @@
+# built-in
+from contextlib import contextmanager
 # cocos2d
 from cocos.director import director
 # gui
-from .css import CSSNode, evaluate as css_evaluate
+from .css import CSSNode, evaluate as css_evaluate, update as css_update
 from .base import SmartLayer
 from .node import GUINode
+from .spatial import QuadTree, intersection
+from .css.rendering import BatchRenderer
+from .caching import LayerCache
 
 class GUILayer(SmartLayer, CSSNode):
   
   is_event_handler = True
   
+  # if True, backgrounds, borders and texts of nodes are drawn
+  # by `BatchRenderer`, at once for each top-level node
+  batch_rendering = False
+  
+  # if True, the layer is kept rendered in a texture, and only
+  # its changed parts are redrawn each frame (see `LayerCache`)
+  dirty_rendering = False
+  
   def __init__(self, *args, **kwargs):
     SmartLayer.__init__(self, *args, **kwargs)
     CSSNode.__init__(self)
+    # world-space border boxes of all evaluated `GUINode`s (refreshed
+    # on visit if the layer's ancestors, e. g. the scene, were moved)
+    self.spatial_index = QuadTree((0, 0) + director.get_window_size())
+    self.__parent_transform = None # see `check_parent_transform`
+    self.__restyle_queue = set()
+    self.__evaluation_queue = set() # see `schedule_evaluation`
+    self.__renderer = None
+    self.__layer_cache = None
+    self.__clip_rects = [] # see `clip`
   
   def order(self):
+    self.__restyle_queue.clear() # everything is evaluated now
+    self.__evaluation_queue.clear()
     css_evaluate(self)
   
+  def request_update(self):
+    self.schedule_restyle(self)
+  
+  def schedule_restyle(self, node):
+    """Postpones restyling of `node` until the next
+    frame (or explicit `flush`), so that several state
+    changes in a row cost a single evaluation.
+    """
+    self.__restyle_queue.add(node)
+  
+  def schedule_evaluation(self, node):
+    """Like `schedule_restyle`, but the whole `node`'s
+    subtree is evaluated (e. g. it was built while detached).
+    """
+    self.__evaluation_queue.add(node)
+  
+  def flush(self):
+    """Restyles all nodes scheduled with `schedule_restyle`.
+    Call it if you need up-to-date boxes right away.
+    """
+    queue, self.__restyle_queue = self.__restyle_queue, set()
+    subtrees, self.__evaluation_queue = self.__evaluation_queue, set()
+    if self in queue:
+      css_evaluate(self)
+      return
+    nodes = [node for node in queue if node.window is self]
+    for node in subtrees:
+      if node.window is self:
+        css_evaluate(self, node)
+        node.parent.layout_dirty = True # it has a new child
+        nodes.append(node.parent)
+    if nodes:
+      css_update(self, nodes)
+  
+  @property
+  def renderer(self):
+    if not self.batch_rendering:
+      return None
+    if self.__renderer is None:
+      self.__renderer = BatchRenderer(self)
+    return self.__renderer
+  
+  @property
+  def layer_cache(self):
+    """`LayerCache` of the layer if `dirty_rendering` is on."""
+    if not self.dirty_rendering:
+      return None
+    if self.__layer_cache is None:
+      self.__layer_cache = LayerCache()
+    return self.__layer_cache
+  
+  def invalidate_rect(self, rect):
+    """Makes `rect` (in world coordinates, may be None) of
+    the layer redrawn next frame, see `dirty_rendering`."""
+    cache = self.layer_cache
+    if cache is not None and rect is not None:
+      cache.invalidate(rect)
+  
+  @contextmanager
+  def clip(self, rect):
+    """Restricts drawing to `rect`, given in world coordinates,
+    inside the `with` block: nodes lying outside of it (and of
+    outer clip rectangles) are not visited (see `clip_rect`).
+    
+    >>> with layer.clip(scissor_box):
+    ...   node.visit()
+    """
+    clip_rect = self.clip_rect
+    if clip_rect is not None:
+      rect = intersection(clip_rect, rect) or (rect[0], rect[1], 0, 0)
+    self.__clip_rects.append(tuple(rect))
+    try:
+      yield rect
+    finally:
+      self.__clip_rects.pop()
+  
+  @property
+  def clip_rect(self):
+    """The current clip rectangle in world coordinates,
+    None outside of `visit`."""
+    if not self.__clip_rects:
+      return None
+    return self.__clip_rects[-1]
+  
+  def visit(self):
+    self.check_parent_transform()
+    # states changed by picking are restyled in the same frame
+    self.update_hit_test()
+    self.flush()
+    if self.renderer is not None:
+      self.renderer.update() # before nodes decide how to draw
+    with self.clip((0, 0) + director.get_window_size()):
+      cache = self.layer_cache
+      if cache is None or not self.visible:
+        super(GUILayer, self).visit()
+      else:
+        cache.visit(self, super(GUILayer, self).visit)
+  
+  @property
+  def is_transform_dirty(self):
+    return self.__transform_dirty
+  
+  @is_transform_dirty.setter
+  def is_transform_dirty(self, value):
+    # cached world transformations of nodes become outdated
+    self.__transform_dirty = value
+    if value:
+      self.invalidate_transform()
+  
+  def invalidate_transform(self):
+    """Makes world transformations (and things depending
+    on them) of all nodes of the layer outdated."""
+    for node in self.get_nodes():
+      node.invalidate_transform()
+      node.reindex(recursive=True)
+    self.invalidate_hit_test()
+    if self.layer_cache is not None:
+      self.layer_cache.invalidate_all()
+  
+  def check_parent_transform(self):
+    """Calls `invalidate_transform` if the world transformation
+    of the layer's parent changed since the previous call (as
+    cocos2d doesn't notify children when their ancestors move)."""
+    parent = self.parent
+    matrix = parent.get_world_transform() if parent is not None else None
+    stamp = tuple(matrix[:]) if matrix is not None else None
+    if stamp != self.__parent_transform:
+      self.__parent_transform = stamp
+      self.invalidate_transform()
+  
   def get_nodes(self):
     return [child for child in self.get_children() if isinstance(child, GUINode)]
   
+  def add(self, child, *args, **kwargs):
+    super(GUILayer, self).add(child, *args, **kwargs)
+    if isinstance(child, GUINode):
+      child.invalidate_transform() # it has a new parent
+      child.reindex(recursive=True)
+      child.attached()
+    elif self.layer_cache is not None:
+      self.layer_cache.invalidate_all()
+    if self.renderer is not None:
+      self.renderer.invalidate_order()
+  
+  def remove(self, obj):
+    if isinstance(obj, GUINode):
+      obj.unindex(recursive=True)
+    elif self.layer_cache is not None:
+      self.layer_cache.invalidate_all()
+    super(GUILayer, self).remove(obj)
+    if self.renderer is not None:
+      self.renderer.invalidate_order()
+  
+  def nodes_at(self, x, y):
+    """Returns `GUINode`s whose border boxes contain
+    point (`x`, `y`), given in world coordinates.
+    """
+    return self.spatial_index.query_point(x, y)
+  
+  def nodes_in_rect(self, rect):
+    """Returns `GUINode`s whose border boxes intersect
+    `rect`, given in world coordinates.
+    """
+    return self.spatial_index.query_rect(rect)
+  
   def get_content_size(self):
     return (director.window.width, director.window.height)
 
@@ -6,6 +6,7 @@ class GUILayout(GUINode):
     super(GUILayout, self).__init__()
     self.spacing = spacing
     self.__nodes = [] # TODO move this whole system to GUINode
+    self.__structure_changed = False
   
   def __len__(self):
     return len(self.children)
@@ -14,8 +15,25 @@ class GUILayout(GUINode):
     return self.__nodes
   
   def add(self, child, *args, **kwargs):
-    super(GUILayout, self).add(child, *args, **kwargs)
-    self.__nodes.append(child)
+    with self.batch():
+      super(GUILayout, self).add(child, *args, **kwargs)
+      self.__nodes.append(child)
+      self.__structure_changed = True
+      self.invalidate_layout()
+  
+  def add_many(self, children):
+    """Adds all `children` at once, restyling the layout
+    a single time (see `GUINode.batch`).
+    """
+    with self.batch():
+      for child in children:
+        self.add(child)
+  
+  def finish_batch(self):
+    super(GUILayout, self).finish_batch()
+    if not self.__structure_changed:
+      return
+    self.__structure_changed = False
     nodes = self.get_nodes()
     nodes_count = len(nodes)
     for i, node in enumerate(nodes):
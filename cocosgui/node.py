@@ -1,17 +1,115 @@
+# built-in
+import weakref
+from contextlib import contextmanager
+# PyOpenGL
 from OpenGL import GL
+# cocos2d
+from cocos import euclid
+# gui
 from .css import CSSNode, evaluate as css_evaluate
 from .base import SmartNode
+from .caching import TextureCache, gl_matrix
+from .spatial import intersects, union
+
+
+def _dead_ref():
+  return None # acts like a dead `weakref.ref`
 
 
 class GUINode(SmartNode, CSSNode):
   def __init__(self, style = None):
+    self.__cache = None # see `texture_cache`
+    self.__relative_transform = None # see `get_world_transform`
+    self.__relative_inverse = None
+    self.__transform_base = None
+    self.__subtree_bounds = None
+    self.__bounds_valid = False
     SmartNode.__init__(self)
     CSSNode.__init__(self, style)
     self.anchor = (0, 0)
+    self.__batch_depth = 0
+    self.__batch_nodes = [] # outdated nodes, see `batch`
+    self.__detached_changes = False # see `request_update`
   
   def order(self):
     css_evaluate(self.window, self.parent)
   
+  def request_update(self):
+    batching = self.__batching_node()
+    if batching is not None:
+      batching.__batch_nodes.append(self)
+      return
+    window = self.window
+    if window is None:
+      # nobody would flush a detached subtree, so it is evaluated
+      # once it gets attached (see `attached`); building it node
+      # by node doesn't evaluate it over and over this way
+      self.__detached_root().__detached_changes = True
+    else:
+      window.schedule_restyle(self)
+  
+  @contextmanager
+  def batch(self):
+    """Suspends restyling of node's subtree; it is restyled
+    once when the outermost `batch` block ends.
+    
+    >>> with layout.batch():
+    ...   for item in items:
+    ...     layout.add(item)
+    """
+    self.__batch_depth += 1
+    try:
+      yield self
+      if self.__batch_depth == 1:
+        self.finish_batch()
+    finally:
+      self.__batch_depth -= 1
+    if not self.__batch_depth and self.__batch_nodes:
+      nodes, self.__batch_nodes = self.__batch_nodes, []
+      batching = self.__batching_node()
+      window = self.window
+      if batching is not None: # ancestor's batch is still running
+        batching.__batch_nodes.extend(nodes)
+      elif window is not None:
+        for node in nodes:
+          window.schedule_restyle(node)
+      else:
+        self.__detached_root().__detached_changes = True
+  
+  def finish_batch(self):
+    """Called at the end of the outermost `batch` block,
+    while restyling is still suspended.
+    """
+    pass
+  
+  def attached(self):
+    """Called when the node is added to a new parent. Hands
+    changes made while the node was detached over to its window
+    (or to the root of the detached subtree it joined).
+    """
+    if not self.__detached_changes:
+      return
+    self.__detached_changes = False
+    window = self.window
+    if window is None:
+      self.__detached_root().__detached_changes = True
+    else:
+      window.schedule_evaluation(self)
+  
+  def __detached_root(self):
+    node = self
+    while isinstance(node.parent, GUINode):
+      node = node.parent
+    return node
+  
+  def __batching_node(self):
+    node = self
+    while isinstance(node, GUINode):
+      if node.__batch_depth:
+        return node
+      node = node.parent
+    return None
+  
   @property
   def z(self):
     siblings = self.parent.children
@@ -22,8 +120,20 @@ class GUINode(SmartNode, CSSNode):
   def z(self, value):
     siblings = self.parent.children
     zvalues, siblings = map(list, zip(*siblings))
-    zvalues[siblings.index(self)] = value
+    index = siblings.index(self)
+    if zvalues[index] == value:
+      return # e. g. set by every `apply_style`
+    zvalues[index] = value
     self.parent.children = sorted(zip(zvalues, siblings))
+    self.invalidate_hit_test()
+    self.invalidate_order()
+    self.invalidate_region(recursive=True)
+  
+  @SmartNode.visible.setter
+  def visible(self, value):
+    SmartNode.visible.fset(self, value)
+    self.invalidate_order()
+    self.invalidate_region(recursive=True)
   
   @property
   def window(self):
@@ -33,17 +143,395 @@ class GUINode(SmartNode, CSSNode):
       parent = parent.parent
     return parent
   
+  @property
+  def renderer(self):
+    """`BatchRenderer` drawing this node's background and
+    border, if any (see `GUILayer.batch_rendering`)."""
+    window = self.window
+    if window is None:
+      return None
+    return window.renderer
+  
+  def invalidate_cache(self):
+    """Makes cached textures of the node and its
+    ancestors (see `caching.TextureCache`) outdated."""
+    node = self
+    while isinstance(node, GUINode):
+      if node.__cache is not None:
+        node.__cache.invalidate()
+      node = node.parent
+  
+  def invalidate_region(self, recursive=False):
+    """Makes the window redraw the area occupied by the node
+    (see `GUILayer.dirty_rendering`)."""
+    window = self.window
+    if window is None or not window.dirty_rendering:
+      return
+    index = window.spatial_index
+    nodes = [self]
+    while nodes:
+      node = nodes.pop()
+      window.invalidate_rect(index.get(node))
+      if recursive:
+        nodes.extend(node.get_nodes())
+  
+  def invalidate_geometry(self, recursive=False):
+    """Notifies caches and renderers that appearance of the
+    node changed (batch renderer rebuilds its geometry)."""
+    self.invalidate_cache()
+    self.invalidate_region(recursive)
+    renderer = self.renderer
+    if renderer is None:
+      return
+    nodes = [self]
+    while nodes:
+      node = nodes.pop()
+      renderer.invalidate(node)
+      if recursive:
+        nodes.extend(node.get_nodes())
+  
+  def invalidate_order(self):
+    """Notifies batch renderer that set or order
+    of drawn nodes changed."""
+    self.invalidate_cache()
+    renderer = self.renderer
+    if renderer is not None:
+      renderer.invalidate_order()
+  
+  @property
+  def is_transform_dirty(self):
+    return self.__transform_dirty
+  
+  @is_transform_dirty.setter
+  def is_transform_dirty(self, value):
+    # cocos2d sets it whenever position, scale or rotation
+    # changes (e. g. by actions, not just `set_position`)
+    self.__transform_dirty = value
+    if value:
+      self.invalidate_transform()
+      if hasattr(self, 'border_box'): # evaluated already
+        self.invalidate_hit_test()
+        self.reindex(recursive=True)
+        self.invalidate_geometry(recursive=True)
+  
+  def invalidate_transform(self):
+    """Makes cached world transformations (and things depending
+    on them) of the node and its descendants outdated."""
+    self.invalidate_bounds()
+    nodes = [self]
+    while nodes:
+      node = nodes.pop()
+      if isinstance(node, GUINode):
+        node.__relative_transform = node.__relative_inverse = None
+        node.__transform_base = None
+        node.__bounds_valid = False
+      nodes.extend(node.get_children())
+  
+  def get_world_transform(self):
+    """Same as `CocosNode.get_world_transform`, but the part
+    below `transform_base` is cached until the node or any
+    of its ancestors is transformed."""
+    matrix = self.get_relative_transform()
+    base = self.transform_base
+    if base is not None:
+      matrix = base.get_world_transform() * matrix
+    return matrix
+  
+  def get_world_inverse(self):
+    """Same as `CocosNode.get_world_inverse`, but
+    cached partially (see `get_world_transform`)."""
+    matrix = self.get_relative_inverse()
+    base = self.transform_base
+    if base is not None:
+      matrix = matrix * base.get_world_inverse()
+    return matrix
+  
+  @property
+  def transform_base(self):
+    """The nearest ancestor whose transformations are not
+    tracked by `is_transform_dirty` (usually the parent of
+    the window) or None."""
+    if self.__transform_base is None:
+      from .layers import GUILayer
+      parent = self.parent
+      if isinstance(parent, GUINode):
+        base = parent.transform_base
+      elif isinstance(parent, GUILayer):
+        base = parent.parent
+      else:
+        base = parent
+      self.__transform_base = _dead_ref if base is None else weakref.ref(base)
+    return self.__transform_base()
+  
+  def get_relative_transform(self):
+    """Transformation from node's coordinates to
+    `transform_base`'s ones, cached."""
+    if self.__relative_transform is None:
+      from .layers import GUILayer
+      matrix = self.get_local_transform()
+      parent = self.parent
+      if isinstance(parent, GUINode):
+        matrix = parent.get_relative_transform() * matrix
+      elif isinstance(parent, GUILayer):
+        matrix = parent.get_local_transform() * matrix
+      self.__relative_transform = matrix
+    return self.__relative_transform
+  
+  def get_relative_inverse(self):
+    """Inverse of `get_relative_transform`, cached."""
+    if self.__relative_inverse is None:
+      from .layers import GUILayer
+      matrix = self.get_local_inverse()
+      parent = self.parent
+      if isinstance(parent, GUINode):
+        matrix = matrix * parent.get_relative_inverse()
+      elif isinstance(parent, GUILayer):
+        matrix = matrix * parent.get_local_inverse()
+      self.__relative_inverse = matrix
+    return self.__relative_inverse
+  
   def get_nodes(self):
     children = self.get_children()
     return [child for child in children if isinstance(child, CSSNode)]
   
-  def draw(self, *args, **kwargs):
-    super(GUINode, self).draw(*args, **kwargs)
+  @property
+  def world_border_box(self):
+    """Bounding rectangle of `border_box` in world coordinates."""
+    return self.rect_to_world(self.border_box)
+  
+  def rect_to_world(self, rect):
+    """Bounding rectangle of local `rect` in world coordinates."""
+    left, bottom, width, height = rect
+    matrix = self.get_world_transform()
+    corners = [matrix * euclid.Point2(x, y) for x, y in (
+      (left, bottom), (left + width, bottom),
+      (left, bottom + height), (left + width, bottom + height),
+    )]
+    xs = [corner.x for corner in corners]
+    ys = [corner.y for corner in corners]
+    return (min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+  
+  def reindex(self, recursive=False):
+    """Updates node's entry in the window's spatial index."""
+    window = self.window
+    if window is None:
+      return
+    self.__reindex(window, recursive)
+  
+  def __reindex(self, window, recursive):
+    if hasattr(self, 'border_box'):
+      rect = self.world_border_box
+      old_rect = window.spatial_index.get(self)
+      if rect != old_rect:
+        window.spatial_index.update(self, rect)
+        window.invalidate_rect(old_rect)
+        window.invalidate_rect(rect)
+        self.invalidate_bounds()
+    if recursive:
+      for node in self.get_nodes():
+        node.__reindex(window, recursive)
+  
+  def unindex(self, recursive=False):
+    """Removes node from the window's spatial index."""
+    window = self.window
+    if window is None:
+      return
+    self.__unindex(window, recursive)
+  
+  def __unindex(self, window, recursive):
+    window.invalidate_rect(window.spatial_index.get(self))
+    window.spatial_index.discard(self)
+    if recursive:
+      for node in self.get_nodes():
+        node.__unindex(window, recursive)
+  
+  @property
+  def subtree_bounds(self):
+    """Bounding rectangle of world border boxes of the node
+    and its descendants (rectangles of sprites, for children
+    which aren't `GUINode`s), or None if it's unknown (e. g.
+    some of them are not evaluated yet)."""
+    if not self.__bounds_valid:
+      self.__subtree_bounds = self.__compute_bounds()
+      self.__bounds_valid = True
+    return self.__subtree_bounds
+  
+  def __compute_bounds(self):
+    bounds = self.world_border_box if hasattr(self, 'border_box') else None
+    known = bounds is not None
+    for z, child in self.children:
+      if isinstance(child, GUINode):
+        child_bounds = child.subtree_bounds
+      elif hasattr(child, 'get_rect'):
+        rect = child.get_rect() # e. g. of a sprite, in our coordinates
+        child_bounds = self.rect_to_world(
+          (rect.x, rect.y, rect.width, rect.height))
+      else:
+        continue # e. g. a text, drawn inside of the node's box
+      if child_bounds is None:
+        known = False # still computing bounds of other children
+      elif bounds is None:
+        bounds = child_bounds
+      else:
+        bounds = union(bounds, child_bounds)
+    return bounds if known else None
+  
+  def invalidate_bounds(self):
+    """Makes `subtree_bounds` of the node and its
+    ancestors to be recomputed."""
+    node = self
+    # bounds of ancestors are outdated already if these are
+    while isinstance(node, GUINode) and node.__bounds_valid:
+      node.__bounds_valid = False
+      node = node.parent
+  
+  def is_culled(self):
+    """Returns True if the whole subtree of the node lies
+    outside of the window's clip rectangle (see
+    `GUILayer.clip`), so that it needs no drawing."""
+    window = self.window
+    clip_rect = window.clip_rect if window is not None else None
+    if clip_rect is None:
+      return False
+    bounds = self.subtree_bounds
+    return bounds is not None and not intersects(bounds, clip_rect)
+  
+  def add(self, child, *args, **kwargs):
+    super(GUINode, self).add(child, *args, **kwargs)
+    if isinstance(child, GUINode):
+      child.invalidate_transform() # it has a new parent
+      child.reindex(recursive=True)
+      child.attached()
+    self.invalidate_order()
+    self.invalidate_bounds()
+  
+  def remove(self, obj):
+    if isinstance(obj, GUINode):
+      obj.unindex(recursive=True)
+    self.invalidate_order()
+    self.invalidate_bounds()
+    super(GUINode, self).remove(obj)
+  
+  def set_position(self, x, y):
+    if self.position != (x, y): # see `is_transform_dirty`
+      super(GUINode, self).set_position(x, y)
+  
+  def apply_style(self, **options):
+    old_border_box = getattr(self, 'border_box', None)
+    super(GUINode, self).apply_style(**options)
+    if self.border_box != old_border_box:
+      self.invalidate_hit_test()
+      self.reindex()
+    self.invalidate_geometry()
+  
+  def repaint(self):
+    super(GUINode, self).repaint()
+    self.invalidate_geometry()
+  
+  # pyglet's text layouts drawn by the node, see `place_texts`
+  text_objects = ()
+  
+  # if False, font and color of `text_objects` are left
+  # as they were created (not taken from the style)
+  styled_texts = True
+  
+  # rectangle (in world coordinates) text objects are clipped
+  # to when drawn, if any (used by the batch renderer)
+  text_clip_rect = None
+  
+  @property
+  def texts_batched(self):
+    """True if `text_objects` are drawn by the layer's batch
+    renderer (see `css.rendering.TextBatch`), not by `draw`."""
+    renderer = self.renderer
+    return renderer is not None and self in renderer.texts
+  
+  def place_texts(self):
+    """Fits `text_objects` into `content_box`. Texts drawn by
+    the batch renderer are placed in layer's coordinates."""
+    x, y, width, height = self.content_box
+    renderer = self.renderer
+    origin = renderer and renderer.text_origin(self)
+    if origin is not None:
+      x, y = origin
+    for text in self.text_objects:
+      if (text.x, text.y, text.width, text.height) != (x, y, width, height):
+        text.begin_update() # laying text out just once
+        text.x, text.y, text.width, text.height = x, y, width, height
+        text.end_update()
+  
+  def hit_test(self, x, y):
+    box = getattr(self, 'border_box', None)
+    if box is None:
+      return False # not evaluated yet
+    left, bottom, width, height = box
+    return left <= x < left + width and bottom <= y < bottom + height
+  
+  @property
+  def texture_cache(self):
+    """`TextureCache` of the node if it has `cache: texture`
+    style (and is evaluated already), None otherwise."""
+    if not hasattr(self, 'border_box') or \
+       self.evaluated_style['cache'] != 'texture':
+      self.__cache = None
+    elif self.__cache is None:
+      self.__cache = TextureCache()
+    return self.__cache
+  
+  def visit(self):
+    if not self.visible or self.is_culled():
+      return
+    cache = self.texture_cache
+    if cache is None:
+      self.__visit()
+    else:
+      cache.visit(self, self.__visit)
+  
+  def __visit(self):
+    # same as `CocosNode.visit`, but node's transformation is
+    # applied just once, and `draw` is called inside of it
+    self.before_visit()
+    grid = self.grid if self.grid and self.grid.active else None
+    if grid is not None:
+      grid.before_draw()
     GL.glPushMatrix()
     self.transform()
-    self.evaluated_style.background.draw()
-    self.evaluated_style.border.draw()
+    children = self.children
+    position = 0
+    while position < len(children) and children[position][0] < 0:
+      children[position][1].visit()
+      position += 1
+    self.draw()
+    for z, child in children[position:]:
+      child.visit()
     GL.glPopMatrix()
+    if grid is not None:
+      grid.after_draw(self.camera)
+    self.after_visit()
+  
+  def draw(self, *args, **kwargs):
+    """Draws the node itself in its local coordinates
+    (unlike `CocosNode.draw`, see `visit`)."""
+    super(GUINode, self).draw(*args, **kwargs)
+    renderer = self.renderer
+    if renderer is None or not renderer.draws(self):
+      self.evaluated_style.background.draw()
+      self.evaluated_style.border.draw()
+    elif self.parent is renderer.layer:
+      # the whole subtree is drawn at once, in layer's coordinates
+      GL.glPushMatrix()
+      GL.glMultMatrixf(gl_matrix(self.get_local_inverse()))
+      renderer.draw(self)
+      GL.glPopMatrix()
+  
+  def draws_custom_content(self):
+    """Returns True if the node draws anything besides its
+    background, border and `text_objects` (by default, if it has
+    children which aren't `CSSNode`s, e. g. sprites). Top-level
+    subtrees having such nodes aren't batched (see `GUILayer.
+    batch_rendering`), so that their drawing order is kept."""
+    return any(not isinstance(child, CSSNode)
+               for child in self.get_children())
   
   def focus(self):
     self.add_state('focus')
@@ -0,0 +1,178 @@
+"""Spatial index for looking up objects by their rectangles.
+
+Rectangles are `(left, bottom, width, height)`, just like
+boxes of `CSSNode`s.
+"""
+
+
+def contains(outer, inner):
+  """Returns True if rectangle `outer` contains `inner`."""
+  return outer[0] <= inner[0] and outer[1] <= inner[1] and \
+         inner[0] + inner[2] <= outer[0] + outer[2] and \
+         inner[1] + inner[3] <= outer[1] + outer[3]
+
+def intersects(a, b):
+  return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and \
+         a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def _contains_point(rect, x, y):
+  return rect[0] <= x < rect[0] + rect[2] and \
+         rect[1] <= y < rect[1] + rect[3]
+
+def intersection(a, b):
+  """Returns intersection of rectangles `a` and `b`,
+  or None if they don't intersect."""
+  left, bottom = max(a[0], b[0]), max(a[1], b[1])
+  right = min(a[0] + a[2], b[0] + b[2])
+  top   = min(a[1] + a[3], b[1] + b[3])
+  if right <= left or top <= bottom:
+    return None
+  return (left, bottom, right - left, top - bottom)
+
+def union(a, b):
+  """Returns bounding rectangle of rectangles `a` and `b`."""
+  left, bottom = min(a[0], b[0]), min(a[1], b[1])
+  right = max(a[0] + a[2], b[0] + b[2])
+  top   = max(a[1] + a[3], b[1] + b[3])
+  return (left, bottom, right - left, top - bottom)
+
+
+class _Quad(object):
+  def __init__(self, bounds, depth):
+    self.bounds = bounds
+    self.depth = depth
+    self.items = {} # item -> rect
+    self.quads = None
+  
+  def child_for(self, rect):
+    """Returns subquad entirely containing `rect`, if any."""
+    for quad in self.quads:
+      if contains(quad.bounds, rect):
+        return quad
+    return None
+  
+  def split(self):
+    x, y, w, h = self.bounds
+    hw, hh = w / 2., h / 2.
+    depth = self.depth + 1
+    self.quads = [
+      _Quad((x,      y,      hw, hh), depth),
+      _Quad((x + hw, y,      hw, hh), depth),
+      _Quad((x,      y + hh, hw, hh), depth),
+      _Quad((x + hw, y + hh, hw, hh), depth),
+    ]
+
+
+class QuadTree(object):
+  """Quadtree keeping rectangles of arbitrary hashable items.
+  
+  Each item is stored in the smallest quad that entirely
+  contains it; items not fitting into `bounds` at all are
+  kept in the root, so the index stays correct (though
+  slower) if objects leave the initial area.
+  
+  >>> index = QuadTree((0, 0, 100, 100))
+  >>> index.insert('a', (10, 10, 5, 5))
+  >>> index.query_point(12, 12)
+  ['a']
+  """
+  
+  def __init__(self, bounds, max_items=8, max_depth=8):
+    self.max_items = max_items
+    self.max_depth = max_depth
+    self.__root = _Quad(tuple(bounds), 0)
+    self.__quads = {} # item -> quad where it is stored
+  
+  def __len__(self):
+    return len(self.__quads)
+  
+  def __contains__(self, item):
+    return item in self.__quads
+  
+  def get(self, item):
+    """Returns rectangle of `item` or None if it isn't indexed."""
+    quad = self.__quads.get(item)
+    if quad is None:
+      return None
+    return quad.items[item]
+  
+  def insert(self, item, rect):
+    if item in self.__quads:
+      self.remove(item)
+    self.__insert(self.__root, item, tuple(rect))
+  
+  def update(self, item, rect):
+    """Moves `item` to a new rectangle (inserting it if needed)."""
+    rect = tuple(rect)
+    quad = self.__quads.get(item)
+    if quad is not None:
+      if quad.items[item] == rect:
+        return
+      if quad.quads is None and (quad is self.__root or
+                                 contains(quad.bounds, rect)):
+        quad.items[item] = rect # still belongs here
+        return
+      del quad.items[item]
+    self.__insert(self.__root, item, rect)
+  
+  def remove(self, item):
+    quad = self.__quads.pop(item)
+    del quad.items[item]
+  
+  def discard(self, item):
+    if item in self.__quads:
+      self.remove(item)
+  
+  def clear(self):
+    self.__root = _Quad(self.__root.bounds, 0)
+    self.__quads.clear()
+  
+  def query_point(self, x, y):
+    """Returns all items whose rectangles contain point (`x`, `y`)."""
+    result = []
+    quad = self.__root
+    while quad is not None:
+      for item, rect in quad.items.iteritems():
+        if _contains_point(rect, x, y):
+          result.append(item)
+      if quad.quads is None:
+        break
+      for subquad in quad.quads:
+        if _contains_point(subquad.bounds, x, y):
+          quad = subquad
+          break
+      else:
+        break
+    return result
+  
+  def query_rect(self, rect):
+    """Returns all items whose rectangles intersect `rect`."""
+    result = []
+    stack = [self.__root]
+    while stack:
+      quad = stack.pop()
+      for item, item_rect in quad.items.iteritems():
+        if intersects(item_rect, rect):
+          result.append(item)
+      if quad.quads is not None:
+        stack.extend(subquad for subquad in quad.quads
+                     if intersects(subquad.bounds, rect))
+    return result
+  
+  def __insert(self, quad, item, rect):
+    while quad.quads is not None:
+      subquad = quad.child_for(rect)
+      if subquad is None:
+        break
+      quad = subquad
+    quad.items[item] = rect
+    self.__quads[item] = quad
+    if quad.quads is None and len(quad.items) > self.max_items \
+       and quad.depth < self.max_depth:
+      quad.split()
+      for other, other_rect in quad.items.items():
+        subquad = quad.child_for(other_rect)
+        if subquad is not None:
+          del quad.items[other]
+          subquad.items[other] = other_rect
+          self.__quads[other] = subquad
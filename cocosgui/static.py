@@ -14,15 +14,35 @@ class Image(GUINode): # TODO: call it just Image
   def apply_style(self, **options):
     super(Image, self).apply_style(**options)
     self.sprite.position = self.content_box[:2]
+    self.invalidate_bounds() # the sprite is moved
 
 
 class Label(GUINode):
+  
+  styled_texts = False # font is given to `cocos.text.Label`
+  
   def __init__(self, style = None, *args, **kwargs):
     super(Label, self).__init__(style)
     self.label = cocos.text.Label(*args, **kwargs)
+    self.text_objects = (self.label.element,)
     self.add(self.label)
   
+  @property
+  def text(self):
+    return self.label.element.text
+  
+  @text.setter
+  def text(self, value):
+    self.label.element.text = value
+    self.invalidate_geometry()
+  
+  def draws_custom_content(self):
+    return False # `label` draws just `text_objects`
+  
   def apply_style(self, **options):
     super(Label, self).apply_style(**options)
-    self.label.position = self.content_box[:2]
+    # the text is fitted into content box by `place_texts`
+    # (or drawn by the batch renderer, and not by `label`)
+    self.label.position = (0, 0)
+    self.place_texts()
 
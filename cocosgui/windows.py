@@ -1,6 +1,11 @@
 from OpenGL import GL
 from cocos.director import director
 from .node import GUINode
+from .spatial import union
+
+
+# half-size of the area a modal window fades (in its coordinates)
+_fade_size = (2000, 2000)
 
 
 def _anchor_to_position_a(anchor, window_size, self_size):
@@ -46,7 +51,7 @@ class AttachedWindow(GUINode):
       anchor_x, anchor_y = self.attach
       x = _anchor_to_position_a(anchor_x, ww, sw)
       y = _anchor_to_position_a(anchor_y, wh, sh)
-      self.position = (x, y)
+      self.set_position(x, y)
   
   def visit(self):
     self.evaluate_position()
@@ -69,7 +74,7 @@ class CenteredWindow(AttachedWindow):
       anchor_x, anchor_y = self.attach
       x = _anchor_to_position_c(anchor_x, ww, sw)
       y = _anchor_to_position_c(anchor_y, wh, sh)
-      self.position = (x, y)
+      self.set_position(x, y)
 
 
 class ModalWindow(CenteredWindow):
@@ -83,19 +88,30 @@ class ModalWindow(CenteredWindow):
     super(ModalWindow, self).apply_style(**options)
     self.z = 777
   
+  @property
+  def world_border_box(self):
+    # the fade is drawn (and hit) far outside of the border box,
+    # so culling and dirty rectangles have to account for it
+    ww, wh = _fade_size
+    fade_rect = self.rect_to_world((-ww, -wh, 2 * ww, 2 * wh))
+    return union(fade_rect, super(ModalWindow, self).world_border_box)
+  
   def draw(self):
-    ww, wh = 2000, 2000
-    GL.glPushMatrix()
-    self.transform()
+    ww, wh = _fade_size
     GL.glPushAttrib(GL.GL_CURRENT_BIT)
     GL.glBegin(GL.GL_QUADS)
     GL.glColor4ubv(self.fade_color)
     map(GL.glVertex2fv, [(-ww, -wh), (ww, -wh), (ww, wh), (-ww, wh)])
     GL.glEnd()
     GL.glPopAttrib()
-    GL.glPopMatrix()
     super(ModalWindow, self).draw()
   
+  def hit_test(self, x, y):
+    return True # fade covers the whole screen
+  
+  def draws_custom_content(self):
+    return True # the fade
+  
   def on_mouse_press(self, x, y, button, modifiers):
     pass # TODO close itself
   